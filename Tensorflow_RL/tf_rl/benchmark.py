@@ -0,0 +1,352 @@
+"""
+Benchmarks of the simulator and learner hot paths.
+
+Every benchmark runs a single operation (game step, observation,
+store, training step, action) on state created from fixed seeds and
+fixed settings, and reports operations per second, latency percentiles
+and peak memory. Results are written as JSON and can be compared
+against a previous run:
+
+    python -m tf_rl.benchmark --output results.json
+    python -m tf_rl.benchmark --baseline results.json --output new.json
+
+Before benchmarking, observe_vectorized is checked to return the same
+observations as observe, up to rounding (see check_observations).
+
+Comparison exits with status 1 if median latency of any benchmark
+grew (or it allocates more memory) by more than tolerance. Median is
+used rather than throughput, as it is less sensitive to occasional
+stalls of a busy machine.
+
+Peak memory is measured with tracemalloc, so it only covers memory
+allocated by python and numpy - TensorFlow allocations are not included.
+"""
+import argparse
+import copy
+import json
+import numpy as np
+import platform
+import sys
+import time
+import tracemalloc
+
+from collections import OrderedDict
+
+WORLD_SIZES   = [(700, 500), (1400, 1000)]
+OBJECT_COUNTS = [25, 100]
+BUFFER_SIZES  = [10000, 50000]
+# large sparse world, where spatial hash should pay off
+LARGE_WORLD_SIZE        = (2800, 2000)
+LARGE_WORLD_OBJECTS     = 400
+SPATIAL_HASH_CELL_SIZES = [None, 240.0]
+# (world_size, number of objects of every type) where observe and
+# observe_vectorized are compared - including worlds where the hero
+# often has no object within reach of its antennas, or none at all.
+OBSERVATION_CHECK_WORLDS = [((700, 500), 25), ((700, 500), 0), ((2800, 2000), 3)]
+# euclid squares with x ** 2 (libm pow), which can differ from exact x * x
+# used by numpy in the last bit, so observations only agree up to rounding.
+OBSERVATION_CHECK_TOLERANCE = 1e-9
+# (target_update_mode, target_update_every, fused_training_step)
+TARGET_UPDATE_POLICIES = [("soft", 1, True), ("soft", 1, False), ("hard", 100, True)]
+
+SEED = 0
+
+def measure(operation, repeats, warmup=10, memory_repeats=10):
+    """Run operation repeats times and return its statistics.
+
+    Latencies are reported in microseconds. Peak memory is the
+    highest amount of memory allocated by memory_repeats additional
+    runs of the operation, measured separately from timing, as
+    tracemalloc slows everything down."""
+    for _ in range(warmup):
+        operation()
+
+    latencies = np.empty(repeats)
+    started_time = time.perf_counter()
+    for i in range(repeats):
+        operation_started_time = time.perf_counter()
+        operation()
+        latencies[i] = time.perf_counter() - operation_started_time
+    seconds = time.perf_counter() - started_time
+
+    tracemalloc.start()
+    try:
+        for _ in range(memory_repeats):
+            operation()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return OrderedDict([
+        ("repeats",           repeats),
+        ("ops_per_second",    repeats / seconds),
+        ("latency_p50_us",    1e6 * float(np.percentile(latencies, 50))),
+        ("latency_p90_us",    1e6 * float(np.percentile(latencies, 90))),
+        ("latency_p99_us",    1e6 * float(np.percentile(latencies, 99))),
+        ("peak_memory_bytes", int(peak_memory)),
+    ])
+
+def game_settings(world_size, num_objects, vectorized_observation=False, spatial_hash_cell_size=None):
+    """Tutorial settings with given world size and number of objects of every type"""
+    from tf_rl.simulation import DEFAULT_SETTINGS
+    settings = copy.deepcopy(DEFAULT_SETTINGS)
+    settings["world_size"]             = world_size
+    settings["num_objects"]            = {obj_type: num_objects for obj_type in settings["objects"]}
+    settings["vectorized_observation"] = vectorized_observation
+    settings["spatial_hash_cell_size"] = spatial_hash_cell_size
+    return settings
+
+def make_game(engine, world_size, num_objects, vectorized_observation=False, spatial_hash_cell_size=None):
+    from tf_rl.simulation import KarpathyGame, ArrayKarpathyGame
+    game_class = ArrayKarpathyGame if engine == "arrays" else KarpathyGame
+    return game_class(game_settings(world_size, num_objects, vectorized_observation, spatial_hash_cell_size),
+                      seed=SEED)
+
+def observe_moving(game):
+    """Return function observing game after moving its hero a little"""
+    nudge = cycle([1e-3, -1e-3])
+    def observe():
+        # hero moves between observations while training, so
+        # walls seen by the antennas are not reused from wall_cache
+        game.hero.position.x += nudge()
+        return game.observe()
+    return observe
+
+def make_controller(buffer_size, hiddens=(200, 200), **kwargs):
+    """DiscreteDeepQ for tutorial observations, in its own graph, with
+    replay buffer filled with buffer_size random transitions"""
+    import tensorflow as tf
+    from tf_rl.controller import DiscreteDeepQ
+    from tf_rl.models import MLP
+    from tf_rl.utils.seeding import spawn_rngs
+
+    game = make_game("arrays", WORLD_SIZES[0], OBJECT_COUNTS[0])
+    model_rng, controller_rng, data_rng = spawn_rngs(SEED, 3)
+
+    graph = tf.Graph()
+    with graph.as_default():
+        session = tf.Session(graph=graph)
+        brain = MLP([game.observation_size,], list(hiddens) + [game.num_actions],
+                    [tf.tanh] * len(hiddens) + [tf.identity], seed=model_rng)
+        optimizer = tf.train.RMSPropOptimizer(learning_rate=0.001, decay=0.9)
+        controller = DiscreteDeepQ(game.observation_size, game.num_actions, brain, optimizer, session,
+                                   max_experience=buffer_size, store_every_nth=1, train_every_nth=1,
+                                   seed=controller_rng, **kwargs)
+        session.run(tf.global_variables_initializer())
+        session.run(controller.target_network_copy)
+
+    observations = data_rng.standard_normal((buffer_size, game.observation_size)).astype(np.float32)
+    controller.experience.add_batch(observations,
+                                    data_rng.integers(game.num_actions, size=buffer_size),
+                                    data_rng.standard_normal(buffer_size),
+                                    np.roll(observations, -1, axis=0),
+                                    np.ones(buffer_size, dtype=np.float32))
+    return controller, observations
+
+def cycle(items):
+    """Return function returning consecutive items, wrapping around"""
+    position = [0]
+    def next_item():
+        item = items[position[0] % len(items)]
+        position[0] += 1
+        return item
+    return next_item
+
+def game_benchmarks():
+    """Yield (name, setup) of simulator benchmarks. setup returns the operation."""
+    for engine in ["objects", "arrays"]:
+        for world_size in WORLD_SIZES:
+            for num_objects in OBJECT_COUNTS:
+                params = "engine=%s,world=%dx%d,objects=%d" % (engine, world_size[0], world_size[1], num_objects)
+
+                def step_setup(engine=engine, world_size=world_size, num_objects=num_objects):
+                    game = make_game(engine, world_size, num_objects)
+                    return lambda: game.step(1.0 / 30)
+                yield "game_step[%s]" % (params,), step_setup
+
+                for vectorized in [False, True]:
+                    def observe_setup(engine=engine, world_size=world_size, num_objects=num_objects,
+                                      vectorized=vectorized):
+                        return observe_moving(make_game(engine, world_size, num_objects, vectorized))
+                    yield "game_observe[%s,vectorized=%s]" % (params, vectorized), observe_setup
+
+    # ArrayKarpathyGame never uses spatial hash, so only KarpathyGame is compared
+    for cell_size in SPATIAL_HASH_CELL_SIZES:
+        params = "engine=objects,world=%dx%d,objects=%d,spatial_hash=%s" % (
+                LARGE_WORLD_SIZE[0], LARGE_WORLD_SIZE[1], LARGE_WORLD_OBJECTS, cell_size)
+
+        def large_step_setup(cell_size=cell_size):
+            game = make_game("objects", LARGE_WORLD_SIZE, LARGE_WORLD_OBJECTS, spatial_hash_cell_size=cell_size)
+            return lambda: game.step(1.0 / 30)
+        yield "game_step[%s]" % (params,), large_step_setup
+
+        for vectorized in [False, True]:
+            def large_observe_setup(cell_size=cell_size, vectorized=vectorized):
+                return observe_moving(make_game("objects", LARGE_WORLD_SIZE, LARGE_WORLD_OBJECTS,
+                                                vectorized, cell_size))
+            yield "game_observe[%s,vectorized=%s]" % (params, vectorized), large_observe_setup
+
+def controller_benchmarks():
+    """Yield (name, setup) of learner benchmarks. setup returns the operation."""
+    for buffer_size in BUFFER_SIZES:
+        def store_setup(buffer_size=buffer_size):
+            controller, observations = make_controller(buffer_size)
+            next_observation = cycle(observations)
+            return lambda: controller.store(next_observation(), 0, 1.0, next_observation())
+        yield "deepq_store[buffer=%d]" % (buffer_size,), store_setup
+
+        for mode, every, fused in TARGET_UPDATE_POLICIES:
+            def training_step_setup(buffer_size=buffer_size, mode=mode, every=every, fused=fused):
+                controller, _ = make_controller(buffer_size,
+                                                target_update_mode=mode,
+                                                target_update_every=every,
+                                                fused_training_step=fused)
+                return controller.training_step
+            yield "deepq_training_step[buffer=%d,target=%s/%d,fused=%s]" % (buffer_size, mode, every, fused), \
+                    training_step_setup
+
+    def action_setup():
+        # always greedy, so that the network is evaluated
+        controller, observations = make_controller(BUFFER_SIZES[0], random_action_probability=0.0,
+                                                   exploration_period=1)
+        next_observation = cycle(observations)
+        return lambda: controller.action(next_observation())
+    yield "deepq_action", action_setup
+
+    def batch_action_setup(batch_size=32):
+        controller, observations = make_controller(BUFFER_SIZES[0], random_action_probability=0.0,
+                                                   exploration_period=1)
+        batches = observations[:batch_size * (len(observations) // batch_size)].reshape(
+                -1, batch_size, observations.shape[1])
+        next_batch = cycle(batches)
+        return lambda: controller.batch_action(next_batch())
+    yield "deepq_batch_action[batch=32]", batch_action_setup
+
+def check_observations(num_frames=600, action_every=3):
+    """Play every world of OBSERVATION_CHECK_WORLDS with both engines, with
+    and without spatial hash, once with observe and once with observe_vectorized,
+    and return names of configurations where observations differ by more
+    than OBSERVATION_CHECK_TOLERANCE."""
+    mismatches = []
+    for engine in ["objects", "arrays"]:
+        for world_size, num_objects in OBSERVATION_CHECK_WORLDS:
+            for cell_size in SPATIAL_HASH_CELL_SIZES:
+                scalar     = make_game(engine, world_size, num_objects, False, cell_size)
+                vectorized = make_game(engine, world_size, num_objects, True,  cell_size)
+                for frame_no in range(num_frames):
+                    scalar.step(1.0 / 30)
+                    vectorized.step(1.0 / 30)
+                    if frame_no % action_every != 0:
+                        continue
+                    difference = np.max(np.abs(scalar.observe() - vectorized.observe()))
+                    if difference > OBSERVATION_CHECK_TOLERANCE:
+                        mismatches.append("engine=%s,world=%dx%d,objects=%d,spatial_hash=%s,frame=%d: %g" % (
+                                engine, world_size[0], world_size[1], num_objects, cell_size, frame_no,
+                                difference))
+                        break
+                    # sweep the world, so that the hero meets walls and objects
+                    action = (frame_no // 30) % scalar.num_actions
+                    scalar.perform_action(action)
+                    vectorized.perform_action(action)
+    return mismatches
+
+def environment():
+    """Versions of everything that influences results"""
+    info = OrderedDict([
+        ("python",   platform.python_version()),
+        ("platform", platform.platform()),
+        ("machine",  platform.machine()),
+        ("numpy",    np.__version__),
+    ])
+    try:
+        import tensorflow as tf
+        info["tensorflow"] = tf.__version__
+    except ImportError:
+        pass
+    return info
+
+def run_benchmarks(name_filter=None, repeats=200, include_controller=True, verbose=True):
+    """Run all the benchmarks whose name contains name_filter
+    and return results as dict, ready to be saved as JSON"""
+    benchmarks = list(game_benchmarks())
+    if include_controller:
+        benchmarks.extend(controller_benchmarks())
+
+    results = OrderedDict()
+    for name, setup in benchmarks:
+        if name_filter is not None and name_filter not in name:
+            continue
+        results[name] = measure(setup(), repeats)
+        if verbose:
+            print("%-75s %12.1f ops/s  p50 %10.1f us  p99 %10.1f us" % (
+                    name, results[name]["ops_per_second"],
+                    results[name]["latency_p50_us"], results[name]["latency_p99_us"]))
+            sys.stdout.flush()
+
+    return OrderedDict([
+        ("environment", environment()),
+        ("timestamp",   time.strftime("%Y-%m-%dT%H:%M:%S")),
+        ("seed",        SEED),
+        ("results",     results),
+    ])
+
+def compare(results, baseline, tolerance=0.1, memory_noise_bytes=65536):
+    """Compare results with baseline (both as returned by run_benchmarks).
+
+    A benchmark regressed if its median latency grew by more than tolerance
+    or its peak memory grew by more than tolerance (and memory_noise_bytes).
+    Returns list of (name, description) of regressions."""
+    regressions = []
+    for name, result in results["results"].items():
+        if name not in baseline["results"]:
+            continue
+        base = baseline["results"][name]
+        slowdown = result["latency_p50_us"] / base["latency_p50_us"]
+        if slowdown > 1.0 + tolerance:
+            regressions.append((name, "median latency %.1f -> %.1f us (%.2fx)" % (
+                    base["latency_p50_us"], result["latency_p50_us"], slowdown)))
+        memory_growth = result["peak_memory_bytes"] - base["peak_memory_bytes"]
+        if memory_growth > max(tolerance * base["peak_memory_bytes"], memory_noise_bytes):
+            regressions.append((name, "peak memory %d -> %d bytes" % (
+                    base["peak_memory_bytes"], result["peak_memory_bytes"])))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark simulator and learner hot paths.")
+    parser.add_argument("--output", default=None, help="write results as JSON to this file")
+    parser.add_argument("--baseline", default=None, help="compare results with JSON written earlier")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="allowed relative growth of median latency and peak memory")
+    parser.add_argument("--filter", default=None, help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--no-controller", action="store_true",
+                        help="skip benchmarks that need TensorFlow")
+    parser.add_argument("--skip-checks", action="store_true",
+                        help="do not check that observe_vectorized matches observe")
+    args = parser.parse_args(argv)
+
+    if not args.skip_checks:
+        mismatches = check_observations()
+        for name in mismatches:
+            print("OBSERVATION MISMATCH %s" % (name,))
+        if mismatches:
+            sys.exit(1)
+
+    results = run_benchmarks(args.filter, args.repeats, include_controller=not args.no_controller)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, description in regressions:
+            print("REGRESSION %s: %s" % (name, description))
+        if regressions:
+            sys.exit(1)
+        print("no regressions against %s" % (args.baseline,))
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,4 @@
 from .discrete_deepq import DiscreteDeepQ
 from .human_controller import HumanController
+from .random_controller import RandomController
+from .replay_buffer import ReplayBuffer, MemmapReplayBuffer, PrioritizedReplayBuffer
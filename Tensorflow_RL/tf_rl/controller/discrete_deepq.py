@@ -1,8 +1,10 @@
 import numpy as np
-import random
 import tensorflow as tf
+import threading
 
-from collections import deque
+from .replay_buffer import ReplayBuffer
+from tf_rl.utils.n_step import NStepAccumulator
+from tf_rl.utils.seeding import spawn_rngs
 
 class DiscreteDeepQ(object):
     def __init__(self, observation_size,
@@ -18,7 +20,15 @@ class DiscreteDeepQ(object):
                        discount_rate=0.95,
                        max_experience=30000,
                        target_network_update_rate=0.01,
-                       summary_writer=None):
+                       summary_writer=None,
+                       replay_buffer=None,
+                       fused_training_step=True,
+                       prefetch_minibatches=0,
+                       target_update_mode="soft",
+                       target_update_every=1,
+                       double_q=False,
+                       n_step=1,
+                       seed=None):
         """Initialized the Deepq object.
 
         Based on:
@@ -72,8 +82,47 @@ class DiscreteDeepQ(object):
             alpha, target network T, and network N. Every
             time N gets updated we execute:
                 T = (1-alpha)*T + alpha*N
+            Only used when target_update_mode is "soft".
         summary_writer: tf.train.SummaryWriter
             writer to log metrics
+        replay_buffer: tf_rl.controller.ReplayBuffer
+            storage for experience. If None, a ReplayBuffer
+            with capacity max_experience is created. Pass
+            PrioritizedReplayBuffer for prioritized replay.
+        fused_training_step: bool
+            if true gradient step and target network update
+            are executed by a single session.run call.
+        prefetch_minibatches: int
+            if positive, a background thread samples minibatches
+            from replay buffer into a queue of that capacity and
+            the train op consumes them directly, so that batch
+            assembly overlaps with gradient computation.
+        target_update_mode: str
+            "soft" - move target network towards network as
+            described for target_network_update_rate, "hard" -
+            copy network weights to target network.
+        target_update_every: int
+            update target network only every n-th training
+            step. Updates touch all the parameters, so on large
+            networks updating less often saves time.
+        double_q: bool
+            if true, use Double DQN targets - action for the
+            next observation is chosen by the network and
+            evaluated by the target network. Both observations
+            and next observations go through the network in a
+            single pass. Based on:
+                https://arxiv.org/abs/1509.06461
+        n_step: int
+            number of rewards summed in a return. Transitions
+            are stored as (s_t, a_t, r_t + ... + d^(n-1)*r_{t+n-1}, s_{t+n})
+            and future rewards are bootstrapped with discount_rate ** n_step.
+        seed: int or np.random.Generator
+            seed of generators used for exploration and for
+            sampling from the replay buffer created when
+            replay_buffer is None. Runs with the same seed take
+            the same actions (given the same network), except when
+            minibatches are prefetched, as then sampling races with
+            storing new experience.
         """
         # memorize arguments
         self.observation_size          = observation_size
@@ -89,56 +138,128 @@ class DiscreteDeepQ(object):
         self.train_every_nth           = train_every_nth
         self.minibatch_size            = minibatch_size
         self.discount_rate             = tf.constant(discount_rate)
+        self.n_step                    = n_step
+        self.reward_discount_rate      = discount_rate
+        self.bootstrap_discount_rate   = tf.constant(discount_rate ** n_step)
         self.max_experience            = max_experience
         self.target_network_update_rate = \
                 tf.constant(target_network_update_rate)
+        self.target_update_mode        = target_update_mode
+        self.target_update_every       = target_update_every
+        self.double_q                  = double_q
+        self.fused_training_step       = fused_training_step
+        self.prefetch_minibatches      = prefetch_minibatches
 
         # deepq state
         self.actions_executed_so_far = 0
-        self.experience = deque()
+        self.rng, replay_buffer_rng  = spawn_rngs(seed, 2)
+        if replay_buffer is None:
+            replay_buffer = ReplayBuffer(max_experience, observation_size, seed=replay_buffer_rng)
+        self.experience = replay_buffer
+        # replay buffer is shared with the prefetching thread
+        self.experience_lock = threading.Lock()
+        self.prefetch_thread = None
+        self.prefetch_stop   = threading.Event()
 
         self.iteration = 0
         self.summary_writer = summary_writer
 
         self.number_of_times_store_called = 0
+        # n-step windows of every stream of transitions passed to store
+        self.n_step_windows = {}
         self.number_of_times_train_called = 0
 
         self.create_variables()
 
     def linear_annealing(self, n, total, p_initial, p_final):
         """Linear annealing between p_initial and p_final
-        over total steps - computes value at step n"""
+        over total steps - computes value at step n.
+
+        n can also be an array of steps."""
+        if np.ndim(n) > 0:
+            return np.where(n >= total, p_final, p_initial - (n * (p_initial - p_final)) / (total))
         if n >= total:
             return p_final
         else:
             return p_initial - (n * (p_initial - p_final)) / (total)
 
+    def create_minibatch_queue(self):
+        """Create queue of minibatches filled by the prefetching thread"""
+        B, O, A = self.minibatch_size, self.observation_size, self.num_actions
+        fields = [
+            ("observation",           tf.float32, (B, O)),
+            ("next_observation",      tf.float32, (B, O)),
+            ("next_observation_mask", tf.float32, (B,)),
+            ("action_mask",           tf.float32, (B, A)),
+            ("rewards",               tf.float32, (B,)),
+            ("importance_weights",    tf.float32, (B,)),
+            ("indices",               tf.int64,   (B,)),
+        ]
+        self.minibatch_queue = tf.FIFOQueue(self.prefetch_minibatches,
+                                            dtypes=[dtype for _, dtype, _ in fields],
+                                            shapes=[shape for _, _, shape in fields],
+                                            names=[name for name, _, _ in fields])
+        self.enqueue_inputs = {name: tf.placeholder(dtype, shape, name=name) for name, dtype, shape in fields}
+        self.enqueue_minibatch = self.minibatch_queue.enqueue(self.enqueue_inputs)
+        self.minibatch = self.minibatch_queue.dequeue()
+
+    def minibatch_input(self, name, dtype, shape):
+        """Placeholder fed by training_step or, when minibatches are
+        prefetched, the corresponding output of the minibatch queue."""
+        if self.minibatch is None:
+            return tf.placeholder(dtype, shape, name=name)
+        return self.minibatch[name]
+
     def create_variables(self):
         self.target_q_network    = self.q_network.copy(scope="target_network")
 
+        self.minibatch = None
+        if self.prefetch_minibatches > 0:
+            with tf.name_scope("minibatch_queue"):
+                self.create_minibatch_queue()
+
         # FOR REGULAR ACTION SCORE COMPUTATION
         with tf.name_scope("taking_action"):
             self.observation        = tf.placeholder(tf.float32, (None, self.observation_size), name="observation")
             self.action_scores      = tf.identity(self.q_network(self.observation), name="action_scores")
-            tf.summary.histogram("action_scores", self.action_scores)
             self.predicted_actions  = tf.argmax(self.action_scores, dimension=1, name="predicted_actions")
+            # observations from the minibatch - when prefetching they come from the queue.
+            train_observation       = self.observation if self.minibatch is None else self.minibatch["observation"]
+            self.next_observation   = self.minibatch_input("next_observation", tf.float32, (None, self.observation_size))
+            if self.double_q:
+                # one pass of the network over observations and next observations.
+                both_scores = self.q_network(tf.concat([train_observation, self.next_observation], 0))
+                self.train_action_scores, self.online_next_action_scores = tf.split(both_scores, 2, axis=0)
+            elif self.minibatch is None:
+                self.train_action_scores = self.action_scores
+            else:
+                self.train_action_scores = self.q_network(train_observation)
+            tf.summary.histogram("action_scores", self.train_action_scores)
 
         with tf.name_scope("estimating_future_rewards"):
             # FOR PREDICTING TARGET FUTURE REWARDS
-            self.next_observation          = tf.placeholder(tf.float32, (None, self.observation_size), name="next_observation")
-            self.next_observation_mask     = tf.placeholder(tf.float32, (None,), name="next_observation_mask")
+            self.next_observation_mask     = self.minibatch_input("next_observation_mask", tf.float32, (None,))
             self.next_action_scores        = tf.stop_gradient(self.target_q_network(self.next_observation))
             tf.summary.histogram("target_action_scores", self.next_action_scores)
-            self.rewards                   = tf.placeholder(tf.float32, (None,), name="rewards")
-            target_values                  = tf.reduce_max(self.next_action_scores, reduction_indices=[1,]) * self.next_observation_mask
-            self.future_rewards            = self.rewards + self.discount_rate * target_values
+            self.rewards                   = self.minibatch_input("rewards", tf.float32, (None,))
+            if self.double_q:
+                # network chooses the action, target network evaluates it.
+                next_actions               = tf.argmax(self.online_next_action_scores, axis=1)
+                next_actions_mask          = tf.one_hot(next_actions, self.num_actions)
+                target_values              = tf.reduce_sum(self.next_action_scores * next_actions_mask, reduction_indices=[1,])
+            else:
+                target_values              = tf.reduce_max(self.next_action_scores, reduction_indices=[1,])
+            target_values                  = target_values * self.next_observation_mask
+            self.future_rewards            = self.rewards + self.bootstrap_discount_rate * target_values
 
         with tf.name_scope("q_value_precition"):
             # FOR PREDICTION ERROR
-            self.action_mask                = tf.placeholder(tf.float32, (None, self.num_actions), name="action_mask")
-            self.masked_action_scores       = tf.reduce_sum(self.action_scores * self.action_mask, reduction_indices=[1,])
-            temp_diff                       = self.masked_action_scores - self.future_rewards
-            self.prediction_error           = tf.reduce_mean(tf.square(temp_diff))
+            self.action_mask                = self.minibatch_input("action_mask", tf.float32, (None, self.num_actions))
+            self.masked_action_scores       = tf.reduce_sum(self.train_action_scores * self.action_mask, reduction_indices=[1,])
+            # importance sampling weights (all ones for uniform replay)
+            self.importance_weights         = self.minibatch_input("importance_weights", tf.float32, (None,))
+            self.td_errors                  = self.masked_action_scores - self.future_rewards
+            self.prediction_error           = tf.reduce_mean(self.importance_weights * tf.square(self.td_errors))
             gradients                       = self.optimizer.compute_gradients(self.prediction_error)
             for i, (grad, var) in enumerate(gradients):
                 if grad is not None:
@@ -153,12 +274,17 @@ class DiscreteDeepQ(object):
 
         # UPDATE TARGET NETWORK
         with tf.name_scope("target_network_update"):
-            self.target_network_update = []
-            for v_source, v_target in zip(self.q_network.variables(), self.target_q_network.variables()):
-                # this is equivalent to target = (1-alpha) * target + alpha * source
-                update_op = v_target.assign_sub(self.target_network_update_rate * (v_target - v_source))
-                self.target_network_update.append(update_op)
-            self.target_network_update = tf.group(*self.target_network_update)
+            self.target_network_update = self.create_target_network_update()
+
+        # COPY NETWORK TO TARGET NETWORK, regardless of target_update_mode
+        with tf.name_scope("target_network_copy"):
+            self.target_network_copy = self.create_target_network_update("hard")
+
+        # GRADIENT STEP FOLLOWED BY TARGET NETWORK UPDATE
+        with tf.name_scope("train_and_update_target"):
+            # target update reads source variables only after train_op modified them.
+            with tf.control_dependencies([self.train_op]):
+                self.train_and_update_target = self.create_target_network_update()
 
         # summaries
         tf.summary.scalar("prediction_error", self.prediction_error)
@@ -166,6 +292,22 @@ class DiscreteDeepQ(object):
         self.summarize = tf.summary.merge_all()
         self.no_op1    = tf.no_op()
 
+    def create_target_network_update(self, mode=None):
+        """Return op moving target network towards q_network (mode "soft")
+        or copying q_network to target network (mode "hard").
+        Uses target_update_mode by default."""
+        mode = mode or self.target_update_mode
+        assert mode in ("soft", "hard"), "Unknown target update mode %s" % (mode,)
+        target_network_update = []
+        for v_source, v_target in zip(self.q_network.variables(), self.target_q_network.variables()):
+            if mode == "soft":
+                # this is equivalent to target = (1-alpha) * target + alpha * source
+                update_op = v_target.assign_sub(self.target_network_update_rate * (v_target - v_source))
+            else:
+                update_op = v_target.assign(v_source)
+            target_network_update.append(update_op)
+        return tf.group(*target_network_update)
+
     def action(self, observation):
         """Given observation returns the action that should be chosen using
         DeepQ learning strategy. Does not backprop."""
@@ -178,23 +320,123 @@ class DiscreteDeepQ(object):
                                               1.0,
                                               self.random_action_probability)
 
-        if random.random() < exploration_p:
-            return random.randint(0, self.num_actions - 1)
+        if self.rng.random() < exploration_p:
+            return int(self.rng.integers(self.num_actions))
         else:
             return self.s.run(self.predicted_actions, {self.observation: observation[np.newaxis,:]})[0]
 
-    def store(self, observation, action, reward, newobservation):
+    def batch_action(self, observations):
+        """Given [batch_size, observation_size] observations returns
+        actions that should be chosen for each of them using DeepQ learning
+        strategy. Exploration probability is annealed as if action was called
+        for every observation in turn, but random numbers are drawn once
+        for the whole batch and all the greedy actions are computed
+        by a single forward pass. Does not backprop."""
+        assert len(observations.shape) == 2, \
+                "Batch action expects [batch_size, observation_size] observations."
+        batch_size = observations.shape[0]
+
+        steps = self.actions_executed_so_far + 1 + np.arange(batch_size)
+        self.actions_executed_so_far += batch_size
+        exploration_p = self.linear_annealing(steps,
+                                              self.exploration_period,
+                                              1.0,
+                                              self.random_action_probability)
+
+        explore = self.rng.random(batch_size) < exploration_p
+        actions = self.rng.integers(0, self.num_actions, size=batch_size)
+        greedy  = ~explore
+        if np.any(greedy):
+            actions[greedy] = self.s.run(self.predicted_actions, {self.observation: observations[greedy]})
+        return actions
+
+    def store(self, observation, action, reward, newobservation, stream=0):
         """Store experience, where starting with observation and
-        execution action, we arrived at the newobservation and got thetarget_network_update
+        execution action, we arrived at the newobservation and got the
         reward reward
 
         If newstate is None, the state/action pair is assumed to be terminal
+
+        Transitions must be passed in order of their occurrence. When
+        they come from many games at once, every game needs a different
+        stream, so that n-step returns are computed per game.
         """
-        if self.number_of_times_store_called % self.store_every_nth == 0:
-            self.experience.append((observation, action, reward, newobservation))
-            if len(self.experience) > self.max_experience:
-                self.experience.popleft()
-        self.number_of_times_store_called += 1
+        window = self.n_step_windows.get(stream)
+        if window is None:
+            window = self.n_step_windows[stream] = NStepAccumulator(self.n_step, self.reward_discount_rate)
+        for transition in window.append(observation, action, reward, newobservation):
+            if self.number_of_times_store_called % self.store_every_nth == 0:
+                with self.experience_lock:
+                    self.experience.add(*transition)
+            self.number_of_times_store_called += 1
+
+    def store_batch(self, states, actions, rewards, newstates, newstates_mask):
+        """Store many transitions at once, for example n-step transitions
+        computed by actors of tf_rl.distributed. Unlike store, the transitions
+        are not passed through the n-step window, but every store_every_nth
+        of them is kept just like in store."""
+        first = (-self.number_of_times_store_called) % self.store_every_nth
+        kept  = slice(first, None, self.store_every_nth)
+        with self.experience_lock:
+            self.experience.add_batch(states[kept], actions[kept], rewards[kept],
+                                      newstates[kept], newstates_mask[kept])
+        self.number_of_times_store_called += len(actions)
+
+    def sample_minibatch(self):
+        """Sample minibatch from replay buffer and compute action mask for it"""
+        with self.experience_lock:
+            batch = self.experience.sample(self.minibatch_size)
+        action_mask = np.zeros((self.minibatch_size, self.num_actions), dtype=np.float32)
+        action_mask[np.arange(self.minibatch_size), batch.actions] = 1
+        return batch, action_mask
+
+    def prefetch_loop(self):
+        """Keep the minibatch queue full until stop_prefetching is called"""
+        while not self.prefetch_stop.is_set():
+            batch, action_mask = self.sample_minibatch()
+            try:
+                self.s.run(self.enqueue_minibatch, {
+                    self.enqueue_inputs["observation"]:           batch.states,
+                    self.enqueue_inputs["next_observation"]:      batch.newstates,
+                    self.enqueue_inputs["next_observation_mask"]: batch.newstates_mask,
+                    self.enqueue_inputs["action_mask"]:           action_mask,
+                    self.enqueue_inputs["rewards"]:               batch.rewards,
+                    self.enqueue_inputs["importance_weights"]:    batch.weights,
+                    self.enqueue_inputs["indices"]:               batch.indices,
+                })
+            except (tf.errors.CancelledError, tf.errors.AbortedError):
+                # session was closed
+                return
+
+    def start_prefetching(self):
+        """Start thread filling the minibatch queue, if not running yet"""
+        if self.prefetch_thread is None:
+            self.prefetch_thread = threading.Thread(target=self.prefetch_loop)
+            self.prefetch_thread.daemon = True
+            self.prefetch_thread.start()
+
+    def stop_prefetching(self):
+        """Stop the prefetching thread. Minibatches left in the queue are
+        kept and the next training_step starts prefetching again."""
+        if self.prefetch_thread is not None:
+            self.prefetch_stop.set()
+            # thread may be blocked on full queue - take minibatches until it notices.
+            options = tf.RunOptions(timeout_in_ms=100)
+            while self.prefetch_thread.is_alive():
+                try:
+                    self.s.run(self.minibatch["indices"], options=options)
+                except tf.errors.DeadlineExceededError:
+                    pass
+            self.prefetch_thread.join()
+            self.prefetch_thread = None
+            self.prefetch_stop.clear()
+
+    def close(self):
+        """Called when simulation stops - stops prefetching thread and
+        flushes persistent replay buffer. Controller can still be used
+        afterwards."""
+        self.stop_prefetching()
+        self.experience.close()
 
     def training_step(self):
         """Pick a self.minibatch_size exeperiences from reply buffer
@@ -204,51 +446,48 @@ class DiscreteDeepQ(object):
             if len(self.experience) <  self.minibatch_size:
                 return
 
-            # sample experience.
-            samples   = random.sample(range(len(self.experience)), self.minibatch_size)
-            samples   = [self.experience[i] for i in samples]
-
-            # bach states
-            states         = np.empty((len(samples), self.observation_size))
-            newstates      = np.empty((len(samples), self.observation_size))
-            action_mask    = np.zeros((len(samples), self.num_actions))
-
-            newstates_mask = np.empty((len(samples),))
-            rewards        = np.empty((len(samples),))
-
-            for i, (state, action, reward, newstate) in enumerate(samples):
-                states[i] = state
-                action_mask[i] = 0
-                action_mask[i][action] = 1
-                rewards[i] = reward
-                if newstate is not None:
-                    newstates[i] = newstate
-                    newstates_mask[i] = 1
-                else:
-                    newstates[i] = 0
-                    newstates_mask[i] = 0
-
-
             calculate_summaries = self.iteration % 100 == 0 and \
                     self.summary_writer is not None
+            update_target = self.iteration % self.target_update_every == 0
+
+            if update_target and self.fused_training_step:
+                train_op = self.train_and_update_target
+            else:
+                train_op = self.train_op
 
-            cost, _, summary_str = self.s.run([
+            fetches = [
                 self.prediction_error,
-                self.train_op,
+                self.td_errors,
+                train_op,
                 self.summarize if calculate_summaries else self.no_op1,
-            ], {
-                self.observation:            states,
-                self.next_observation:       newstates,
-                self.next_observation_mask:  newstates_mask,
-                self.action_mask:            action_mask,
-                self.rewards:                rewards,
-            })
-
-            self.s.run(self.target_network_update)
+            ]
+
+            if self.minibatch is None:
+                # sample experience.
+                batch, action_mask = self.sample_minibatch()
+                cost, td_errors, _, summary_str = self.s.run(fetches, {
+                    self.observation:            batch.states,
+                    self.next_observation:       batch.newstates,
+                    self.next_observation_mask:  batch.newstates_mask,
+                    self.action_mask:            action_mask,
+                    self.rewards:                batch.rewards,
+                    self.importance_weights:     batch.weights,
+                })
+                indices = batch.indices
+            else:
+                # experience was sampled by prefetching thread.
+                self.start_prefetching()
+                cost, td_errors, _, summary_str, indices = self.s.run(fetches + [self.minibatch["indices"]])
+
+            with self.experience_lock:
+                self.experience.update_priorities(indices, td_errors)
+
+            if update_target and not self.fused_training_step:
+                self.s.run(self.target_network_update)
 
             if calculate_summaries:
                 self.summary_writer.add_summary(summary_str, self.iteration)
 
             self.iteration += 1
 
-        self.number_of_times_train_called += 1
\ No newline at end of file
+        self.number_of_times_train_called += 1
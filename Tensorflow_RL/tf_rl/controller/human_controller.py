@@ -2,12 +2,12 @@ import sys, os
 sys.path.append(os.path.abspath('../..'))
 
 from tf_rl.utils.getch import getch
-from redis import StrictRedis
 
 import random
 
 class HumanController(object):
     def __init__(self, mapping):
+        from redis import StrictRedis
         self.mapping = mapping
         self.r = StrictRedis()
         self.experience = []
@@ -16,7 +16,7 @@ class HumanController(object):
         return self.mapping[self.r.get("action")]
         #return random.randint(0,3)
 
-    def store(self, observation, action, reward, newobservation):
+    def store(self, observation, action, reward, newobservation, stream=0):
         pass
 
     def training_step(self):
@@ -25,6 +25,7 @@ class HumanController(object):
 
 
 def control_me():
+    from redis import StrictRedis
     r = StrictRedis()
     while True:
         c = getch()
@@ -0,0 +1,21 @@
+from tf_rl.utils.seeding import make_rng
+
+class RandomController(object):
+    def __init__(self, num_actions, seed=None):
+        """Chooses actions uniformly at random and does not learn.
+
+        Useful for measuring simulator throughput."""
+        self.num_actions = num_actions
+        self.rng         = make_rng(seed)
+
+    def action(self, o):
+        return int(self.rng.integers(self.num_actions))
+
+    def batch_action(self, observations):
+        return self.rng.integers(self.num_actions, size=len(observations))
+
+    def store(self, observation, action, reward, newobservation, stream=0):
+        pass
+
+    def training_step(self):
+        pass
@@ -0,0 +1,345 @@
+import json
+import numpy as np
+import os
+
+from collections import namedtuple
+from os.path import join, exists
+
+from tf_rl.utils.seeding import make_rng
+from tf_rl.utils.segment_tree import SegmentTree, SumTree
+
+Minibatch = namedtuple("Minibatch", ["indices", "states", "actions", "rewards",
+                                     "newstates", "newstates_mask", "weights"])
+
+class ReplayBuffer(object):
+    def __init__(self, capacity, observation_size, seed=None):
+        """Fixed size experience replay memory.
+
+        Transitions are kept in preallocated numpy arrays which are
+        used as a ring buffer - once capacity is reached the oldest
+        transition is overwritten. Insertion is O(1) and a minibatch
+        is gathered with one fancy-indexing operation per array, so
+        the cost of sampling does not depend on capacity.
+
+        Parameters
+        -------
+        capacity: int
+            maximum number of transitions kept
+        observation_size: int
+            length of the vector passed as observation
+        seed: int or np.random.Generator
+            seed of the generator used for sampling
+        """
+        self.capacity         = capacity
+        self.observation_size = observation_size
+        self.rng              = make_rng(seed)
+
+        # position where next transition will be written and
+        # number of valid transitions in the buffer.
+        self.cursor = 0
+        self.size   = 0
+
+        self.allocate()
+
+    def fields(self):
+        """Name, shape and dtype of every array storing transitions"""
+        return [
+            ("states",         (self.capacity, self.observation_size), np.float32),
+            ("actions",        (self.capacity,),                       np.int32),
+            ("rewards",        (self.capacity,),                       np.float32),
+            ("newstates",      (self.capacity, self.observation_size), np.float32),
+            ("newstates_mask", (self.capacity,),                       np.float32),
+        ]
+
+    def allocate(self):
+        """Create storage arrays for transitions"""
+        for name, shape, dtype in self.fields():
+            setattr(self, name, np.zeros(shape, dtype=dtype))
+
+    def __len__(self):
+        return self.size
+
+    def add(self, observation, action, reward, newobservation):
+        """Store a single transition and return its index.
+
+        If newobservation is None, the transition is assumed to be terminal.
+        """
+        idx = self.cursor
+        self.states[idx]  = observation
+        self.actions[idx] = action
+        self.rewards[idx] = reward
+        if newobservation is None:
+            self.newstates[idx]      = 0
+            self.newstates_mask[idx] = 0
+        else:
+            self.newstates[idx]      = newobservation
+            self.newstates_mask[idx] = 1
+
+        self.cursor = (idx + 1) % self.capacity
+        self.size   = min(self.size + 1, self.capacity)
+        return idx
+
+    def add_batch(self, states, actions, rewards, newstates, newstates_mask):
+        """Store a batch of transitions and return their indices.
+
+        Terminal transitions are marked with newstates_mask equal to 0."""
+        indices = (self.cursor + np.arange(len(actions))) % self.capacity
+        self.states[indices]         = states
+        self.actions[indices]        = actions
+        self.rewards[indices]        = rewards
+        self.newstates[indices]      = newstates
+        self.newstates_mask[indices] = newstates_mask
+
+        self.cursor = (self.cursor + len(actions)) % self.capacity
+        self.size   = min(self.size + len(actions), self.capacity)
+        return indices
+
+    def sample(self, batch_size):
+        """Sample batch_size transitions uniformly (with replacement)."""
+        indices = self.rng.integers(0, self.size, size=batch_size)
+        return self.gather(indices)
+
+    def gather(self, indices, weights=None):
+        """Return transitions stored at indices as a Minibatch.
+
+        If weights are not given, all samples are weighted equally."""
+        if weights is None:
+            weights = np.ones(len(indices), dtype=np.float32)
+        return Minibatch(indices,
+                         self.states[indices],
+                         self.actions[indices],
+                         self.rewards[indices],
+                         self.newstates[indices],
+                         self.newstates_mask[indices],
+                         weights)
+
+    def update_priorities(self, indices, td_errors):
+        """Uniform buffer ignores temporal difference errors"""
+        pass
+
+    def close(self):
+        """Called when the buffer is no longer written to. In-memory
+        buffers have nothing to release."""
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MemmapReplayBuffer(ReplayBuffer):
+    HEADER_FILE = "header.json"
+
+    def __init__(self, directory, capacity, observation_size, flush_every=1000, seed=None):
+        """Replay memory stored on disk, that survives restarts.
+
+        Every transition array is a np.memmap file in directory and
+        header.json records capacity, write cursor and fill level.
+        If the directory already holds a buffer it is reopened in place
+        (nothing is copied into RAM), otherwise a new one is created.
+        Capacity is therefore limited by disk rather than memory.
+
+        Header is only written every flush_every insertions, so close
+        the buffer (or use it as a context manager) when done with it:
+
+            with MemmapReplayBuffer("experience", 100000, observation_size) as buffer:
+                controller = DiscreteDeepQ(..., replay_buffer=buffer)
+                simulate(game, controller)
+
+        simulate and run_headless close controller (and so its buffer)
+        when they stop.
+
+        Parameters
+        -------
+        directory: str
+            where to keep the buffer files
+        capacity: int
+            maximum number of transitions kept
+        observation_size: int
+            length of the vector passed as observation
+        flush_every: int
+            header and dirty pages are flushed every
+            flush_every insertions and on close. Transitions
+            written after the last flush are forgotten when
+            the process dies.
+        seed: int or np.random.Generator
+            seed of the generator used for sampling
+        """
+        self.directory   = directory
+        self.flush_every = flush_every
+        self.adds_since_flush = 0
+        super(MemmapReplayBuffer, self).__init__(capacity, observation_size, seed)
+
+    def header_path(self):
+        return join(self.directory, self.HEADER_FILE)
+
+    def allocate(self):
+        """Open memory mapped arrays, creating them if necessary"""
+        if exists(self.header_path()):
+            with open(self.header_path()) as f:
+                header = json.load(f)
+            if (header["capacity"], header["observation_size"]) != (self.capacity, self.observation_size):
+                raise ValueError("Buffer in %s has capacity %d and observation size %d, expected %d and %d" % (
+                        self.directory, header["capacity"], header["observation_size"],
+                        self.capacity, self.observation_size))
+            self.cursor = header["cursor"]
+            self.size   = header["size"]
+            mode = "r+"
+        else:
+            if not exists(self.directory):
+                os.makedirs(self.directory)
+            mode = "w+"
+
+        for name, shape, dtype in self.fields():
+            setattr(self, name, np.memmap(join(self.directory, name + ".dat"),
+                                          dtype=dtype, mode=mode, shape=shape))
+        if mode == "w+":
+            self.write_header()
+
+    def write_header(self):
+        header = {
+            "capacity":         self.capacity,
+            "observation_size": self.observation_size,
+            "cursor":           self.cursor,
+            "size":             self.size,
+        }
+        # write to temporary file first, so that header is never half written.
+        tmp_path = self.header_path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(header, f)
+        os.replace(tmp_path, self.header_path())
+
+    def flush(self):
+        """Write dirty pages and current header to disk"""
+        for name, _, _ in self.fields():
+            getattr(self, name).flush()
+        self.write_header()
+        self.adds_since_flush = 0
+
+    def close(self):
+        """Flush everything to disk. The buffer can still be used
+        afterwards, so closing more than once is harmless."""
+        self.flush()
+
+    def add(self, observation, action, reward, newobservation):
+        idx = super(MemmapReplayBuffer, self).add(observation, action, reward, newobservation)
+        self.adds_since_flush += 1
+        if self.adds_since_flush >= self.flush_every:
+            self.flush()
+        return idx
+
+    def add_batch(self, states, actions, rewards, newstates, newstates_mask):
+        indices = super(MemmapReplayBuffer, self).add_batch(states, actions, rewards, newstates, newstates_mask)
+        self.adds_since_flush += len(indices)
+        if self.adds_since_flush >= self.flush_every:
+            self.flush()
+        return indices
+
+    def sample(self, batch_size):
+        """Sample batch_size transitions uniformly (with replacement).
+
+        Indices are sorted, so that pages are read in file order."""
+        indices = np.sort(self.rng.integers(0, self.size, size=batch_size))
+        return self.gather(indices)
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    def __init__(self, capacity, observation_size,
+                       alpha=0.6,
+                       beta=0.4,
+                       beta_annealing_period=100000,
+                       epsilon=1e-6,
+                       seed=None):
+        """Replay memory with proportional prioritization.
+
+        Based on:
+            https://arxiv.org/abs/1511.05952
+
+        Transition i is sampled with probability p_i^alpha / sum_k p_k^alpha,
+        where p_i is the absolute temporal difference error last
+        observed for i. New transitions get the highest priority seen
+        so far. Sampling and priority updates are O(log n) thanks
+        to a sum tree over priorities.
+
+        Parameters
+        -------
+        capacity: int
+            maximum number of transitions kept
+        observation_size: int
+            length of the vector passed as observation
+        alpha: float
+            how much prioritization is used (0 - uniform sampling)
+        beta: float
+            importance sampling correction exponent. It is annealed
+            linearly from beta to 1 over beta_annealing_period
+            calls to sample.
+        beta_annealing_period: int
+            number of sampled minibatches until beta reaches 1
+        epsilon: float
+            added to every priority, so that no transition
+            has zero probability of being sampled
+        seed: int or np.random.Generator
+            seed of the generator used for sampling
+        """
+        super(PrioritizedReplayBuffer, self).__init__(capacity, observation_size, seed)
+        self.alpha                 = alpha
+        self.beta_initial          = beta
+        self.beta_annealing_period = beta_annealing_period
+        self.epsilon               = epsilon
+
+        self.sum_tree     = SumTree(capacity)
+        self.min_tree     = SegmentTree(capacity, np.minimum, float('inf'))
+        self.max_priority = 1.0
+        self.number_of_samples = 0
+
+    def beta(self):
+        progress = min(1.0, float(self.number_of_samples) / self.beta_annealing_period)
+        return self.beta_initial + progress * (1.0 - self.beta_initial)
+
+    def add(self, observation, action, reward, newobservation):
+        idx = super(PrioritizedReplayBuffer, self).add(observation, action, reward, newobservation)
+        priority = self.max_priority ** self.alpha
+        self.sum_tree.update([idx], priority)
+        self.min_tree.update([idx], priority)
+        return idx
+
+    def add_batch(self, states, actions, rewards, newstates, newstates_mask):
+        indices = super(PrioritizedReplayBuffer, self).add_batch(states, actions, rewards, newstates, newstates_mask)
+        priority = self.max_priority ** self.alpha
+        self.sum_tree.update(indices, priority)
+        self.min_tree.update(indices, priority)
+        return indices
+
+    def sample(self, batch_size):
+        """Sample batch_size transitions proportionally to their priority.
+
+        Sampling is stratified - priority mass is split into batch_size
+        equal segments and one transition is drawn from each. Returned
+        minibatch contains importance sampling weights normalized,
+        so that the largest possible weight is 1."""
+        total   = self.sum_tree.reduce()
+        segment = total / batch_size
+        prefix_sums = (np.arange(batch_size) + self.rng.random(batch_size)) * segment
+        indices = self.sum_tree.find_prefix_sum(prefix_sums)
+        # rounding errors can lead past the last filled slot.
+        indices = np.minimum(indices, self.size - 1)
+
+        beta = self.beta()
+        probabilities   = self.sum_tree[indices] / total
+        min_probability = self.min_tree.reduce() / total
+        max_weight      = (self.size * min_probability) ** (-beta)
+        weights         = (self.size * probabilities) ** (-beta) / max_weight
+
+        self.number_of_samples += 1
+        return self.gather(indices, weights.astype(np.float32))
+
+    def update_priorities(self, indices, td_errors):
+        """Set priorities of transitions at indices to their
+        absolute temporal difference errors."""
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, float(np.max(priorities)))
+        priorities = priorities ** self.alpha
+        self.sum_tree.update(indices, priorities)
+        self.min_tree.update(indices, priorities)
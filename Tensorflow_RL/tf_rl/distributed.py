@@ -0,0 +1,273 @@
+"""
+Distributed experience collection in the style of Ape-X / Gorila.
+
+Several actor processes play their own games with a local copy of
+the Q-network weights and ship transitions to a single learner,
+which trains DiscreteDeepQ and periodically broadcasts fresh weights.
+Actors evaluate the network with tf_rl.numpy_models, so they never
+import TensorFlow.
+"""
+import multiprocessing
+import numpy as np
+import time
+
+from queue import Empty, Full
+
+from tf_rl.simulate import FrameStepper, close_controller
+from tf_rl.utils.n_step import NStepAccumulator
+from tf_rl.utils.seeding import spawn_rngs
+
+def actor_epsilon(actor_id, num_actors, base_epsilon=0.4, alpha=7.0):
+    """Exploration rate of actor_id, as in Ape-X paper: actors span
+    range of exploration rates from base_epsilon down to base_epsilon^(1+alpha)"""
+    if num_actors == 1:
+        return base_epsilon
+    return base_epsilon ** (1.0 + alpha * actor_id / (num_actors - 1))
+
+class ActorController(object):
+    def __init__(self, policy, num_actions, epsilon, observation_size, chunk_size,
+                 n_step=1, discount_rate=0.95, rng=None):
+        """Controller of an actor process. Chooses actions epsilon greedily
+        using policy (NumpyMLP) and collects n_step transitions into
+        arrays of chunk_size transitions, which are sent to the learner.
+        It never trains."""
+        self.policy      = policy
+        self.num_actions = num_actions
+        self.epsilon     = epsilon
+        self.rng         = rng
+
+        self.states    = np.empty((chunk_size, observation_size), dtype=np.float32)
+        self.newstates = np.empty((chunk_size, observation_size), dtype=np.float32)
+        self.actions   = np.empty((chunk_size,), dtype=np.int32)
+        self.rewards   = np.empty((chunk_size,), dtype=np.float32)
+        self.filled    = 0
+        self.window    = NStepAccumulator(n_step, discount_rate)
+
+    def action(self, observation):
+        if self.rng.random() < self.epsilon:
+            return int(self.rng.integers(self.num_actions))
+        return int(self.policy.predict_actions(observation[np.newaxis, :])[0])
+
+    def store(self, observation, action, reward, newobservation, stream=0):
+        for transition in self.window.append(observation, action, reward, newobservation):
+            (self.states[self.filled], self.actions[self.filled],
+             self.rewards[self.filled], self.newstates[self.filled]) = transition
+            self.filled += 1
+
+    def training_step(self):
+        pass
+
+    def chunk_full(self):
+        return self.filled == len(self.actions)
+
+    def take_chunk(self):
+        """Return copies of collected transitions and start a new chunk"""
+        chunk = (self.states.copy(), self.actions.copy(), self.rewards.copy(), self.newstates.copy())
+        self.filled = 0
+        return chunk
+
+def actor_process(actor_id, settings, game_class, epsilon,
+                  weights_queue, transitions_queue, stop_event,
+                  fps, action_every, simulation_resolution, chunk_size,
+                  n_step=1, discount_rate=0.95, seed=None):
+    """Play game_class(settings) forever, choosing actions epsilon greedily
+    using the latest NumpyMLP received on weights_queue and putting chunks
+    of chunk_size n_step transitions on transitions_queue as tuples
+
+        (actor_id, states, actions, rewards, newstates, seconds_spent)
+    """
+    game_rng, rng = spawn_rngs(seed, 2)
+    game = game_class(settings, seed=game_rng)
+
+    controller = ActorController(weights_queue.get(), game.num_actions, epsilon,
+                                 game.observation_size, chunk_size, n_step, discount_rate, rng)
+    stepper = FrameStepper(game, controller, fps, action_every, simulation_resolution,
+                           disable_training=True)
+
+    chunk_started_time = time.time()
+    frame_no = 0
+    while not stop_event.is_set():
+        stepper.step(frame_no)
+
+        if controller.chunk_full():
+            chunk = (actor_id,) + controller.take_chunk() + (time.time() - chunk_started_time,)
+            while not stop_event.is_set():
+                try:
+                    transitions_queue.put(chunk, timeout=0.1)
+                    break
+                except Full:
+                    pass
+            chunk_started_time = time.time()
+
+            # use the most recent weights, if any were broadcasted.
+            try:
+                while True:
+                    controller.policy = weights_queue.get_nowait()
+            except Empty:
+                pass
+
+        frame_no += 1
+
+    # do not wait for learner to read chunks that will never be used.
+    transitions_queue.cancel_join_thread()
+
+class DistributedTrainer(object):
+    def __init__(self, settings, controller, num_actors,
+                       game_class=None,
+                       broadcast_every=100,
+                       fps=30,
+                       action_every=3,
+                       simulation_resolution=None,
+                       chunk_size=64,
+                       base_epsilon=0.4,
+                       epsilon_alpha=7.0,
+                       max_queued_chunks=256,
+                       seed=None):
+        """Trains controller on experience collected by num_actors
+        actor processes.
+
+        Parameters
+        -------
+        settings: dict
+            settings of the game played by every actor
+        controller: tf_rl.controller.DiscreteDeepQ
+            learner. Its q_network must be tf_rl.models.MLP.
+            Actors compute returns with its n_step and discount rate.
+        num_actors: int
+            number of actor processes
+        game_class: class
+            game played by actors, KarpathyGame by default
+        broadcast_every: int
+            send weights to actors every broadcast_every training steps
+        fps, action_every, simulation_resolution:
+            same as in tf_rl.simulate
+        chunk_size: int
+            number of transitions actors send at once
+        base_epsilon, epsilon_alpha: float
+            exploration rate of actor i is
+            base_epsilon^(1 + epsilon_alpha * i / (num_actors - 1))
+        max_queued_chunks: int
+            actors block when learner falls behind by this many chunks
+        seed: int
+            every actor seeds its game and exploration with
+            a generator derived from seed. Runs are still not
+            reproducible, as the order in which chunks
+            arrive depends on timing.
+        """
+        if game_class is None:
+            from tf_rl.simulation import KarpathyGame
+            game_class = KarpathyGame
+        self.controller      = controller
+        self.num_actors      = num_actors
+        self.broadcast_every = broadcast_every
+
+        context = multiprocessing.get_context("spawn")
+        self.stop_event        = context.Event()
+        self.transitions_queue = context.Queue(maxsize=max_queued_chunks)
+        self.weights_queues    = [context.Queue() for _ in range(num_actors)]
+        actor_rngs             = spawn_rngs(seed, num_actors)
+
+        self.actors = [
+            context.Process(target=actor_process, args=(
+                    actor_id, settings, game_class,
+                    actor_epsilon(actor_id, num_actors, base_epsilon, epsilon_alpha),
+                    self.weights_queues[actor_id], self.transitions_queue, self.stop_event,
+                    fps, action_every, simulation_resolution, chunk_size,
+                    controller.n_step, controller.reward_discount_rate, actor_rngs[actor_id]))
+            for actor_id in range(num_actors)
+        ]
+
+        self.transitions_received = [0] * num_actors
+        self.actor_seconds        = [0.0] * num_actors
+        self.training_steps       = 0
+        self.training_seconds     = 0.0
+
+    def start(self):
+        for actor in self.actors:
+            actor.daemon = True
+            actor.start()
+        self.broadcast_weights()
+
+    def broadcast_weights(self):
+        policy = self.controller.q_network.to_numpy(self.controller.s)
+        for weights_queue in self.weights_queues:
+            weights_queue.put(policy)
+
+    def receive_transitions(self):
+        """Move all the transitions sent by actors to the replay buffer"""
+        while True:
+            try:
+                actor_id, states, actions, rewards, newstates, seconds = self.transitions_queue.get_nowait()
+            except Empty:
+                return
+            self.controller.store_batch(states, actions, rewards, newstates,
+                                        np.ones(len(actions), dtype=np.float32))
+            self.transitions_received[actor_id] += len(actions)
+            self.actor_seconds[actor_id]        += seconds
+
+    def train(self, num_steps):
+        """Perform num_steps training steps, ingesting experience
+        and broadcasting weights in between.
+
+        Only calls of controller.training_step that update the network
+        (every train_every_nth) are counted as training steps.
+        Raises RuntimeError if an actor process died."""
+        started_time = time.time()
+        target_steps = self.training_steps + num_steps
+        while self.training_steps < target_steps:
+            self.check_actors()
+            self.receive_transitions()
+            while len(self.controller.experience) < self.controller.minibatch_size:
+                time.sleep(0.01)
+                self.check_actors()
+                self.receive_transitions()
+            iteration = self.controller.iteration
+            self.controller.training_step()
+            if self.controller.iteration == iteration:
+                continue
+            self.training_steps += 1
+            if self.training_steps % self.broadcast_every == 0:
+                self.broadcast_weights()
+        self.training_seconds += time.time() - started_time
+
+    def check_actors(self):
+        """Raise RuntimeError if any of the actors exited. Actors only
+        stop when asked to, so otherwise learner would wait for
+        transitions forever."""
+        for actor_id, actor in enumerate(self.actors):
+            if not actor.is_alive():
+                raise RuntimeError("actor %d exited with exit code %s" % (actor_id, actor.exitcode))
+
+    def stats(self):
+        """Transitions per second of every actor and learner steps per second"""
+        return {
+            "actor_transitions_per_second": [
+                    n / s if s > 0 else 0.0 for n, s in zip(self.transitions_received, self.actor_seconds)],
+            "transitions_received": sum(self.transitions_received),
+            "learner_steps_per_second": self.training_steps / max(self.training_seconds, 1e-9),
+        }
+
+    def stop(self):
+        """Stop actors and the prefetching thread of the controller"""
+        self.stop_event.set()
+        close_controller(self.controller)
+        # actors that stopped will never read weights still in the pipes.
+        for weights_queue in self.weights_queues:
+            weights_queue.cancel_join_thread()
+        for actor in self.actors:
+            actor.join(timeout=5)
+            if actor.is_alive():
+                actor.terminate()
+
+def train_distributed(settings, controller, num_actors, num_steps, **kwargs):
+    """Train controller for num_steps using num_actors actor processes.
+    Keyword arguments are passed to DistributedTrainer.
+
+    Returns statistics of the run."""
+    trainer = DistributedTrainer(settings, controller, num_actors, **kwargs)
+    trainer.start()
+    try:
+        trainer.train(num_steps)
+    finally:
+        trainer.stop()
+    return trainer.stats()
@@ -0,0 +1,172 @@
+"""
+Headless simulation runner.
+
+Runs a simulation for a fixed number of frames as fast as possible,
+without sleeping, rendering or IPython, and reports what happened.
+It can be used from python (run_headless) or from the command line:
+
+    python -m tf_rl.headless --frames 10000 --controller deepq
+"""
+import argparse
+import copy
+import json
+import time
+
+from collections import defaultdict
+
+from tf_rl.simulate import FrameStepper
+
+def run_headless(simulation,
+                 controller,
+                 num_frames=None,
+                 num_episodes=None,
+                 frames_per_episode=1000,
+                 fps=60,
+                 action_every=1,
+                 simulation_resolution=None,
+                 disable_training=False,
+                 record_path=None):
+    """Run the simulation without visualization and return summary statistics.
+
+    Exactly one of num_frames and num_episodes must be given. Karpathy game
+    never ends, so an episode is just a segment of frames_per_episode
+    frames, that is reported separately.
+
+    Parameters
+    -------
+    simulation: tr_lr.simulation
+        simulation that will be simulated
+    controller: tr_lr.controller
+        controller used
+    num_frames: int
+        number of frames to simulate
+    num_episodes: int
+        number of episodes to simulate
+    frames_per_episode: int
+        length of an episode in frames
+    fps, action_every, simulation_resolution, disable_training, record_path:
+        same as in tf_rl.simulate
+
+    Returns
+    -------
+    dict with total_reward, episode_rewards, objects_eaten,
+    frames, seconds and frames_per_second.
+    """
+    assert (num_frames is None) != (num_episodes is None), \
+            "Exactly one of num_frames and num_episodes must be given."
+    if num_frames is None:
+        num_frames = num_episodes * frames_per_episode
+
+    objects_eaten_before = dict(getattr(simulation, "objects_eaten", {}))
+    episode_rewards = [0.0]
+
+    stepper = FrameStepper(simulation, controller, fps, action_every, simulation_resolution,
+                           disable_training, record_path=record_path)
+
+    started_time = time.time()
+    try:
+        for frame_no in range(num_frames):
+            if frame_no > 0 and frame_no % frames_per_episode == 0:
+                episode_rewards.append(0.0)
+
+            reward = stepper.step(frame_no)
+            if reward is not None:
+                episode_rewards[-1] += reward
+        seconds = time.time() - started_time
+    finally:
+        stepper.close()
+
+    objects_eaten = defaultdict(lambda: 0)
+    for obj_type, count in getattr(simulation, "objects_eaten", {}).items():
+        objects_eaten[obj_type] = count - objects_eaten_before.get(obj_type, 0)
+
+    return {
+        "total_reward":      sum(episode_rewards),
+        "episode_rewards":   episode_rewards,
+        "objects_eaten":     dict(objects_eaten),
+        "frames":            num_frames,
+        "seconds":           seconds,
+        "frames_per_second": num_frames / max(seconds, 1e-9),
+    }
+
+def make_deepq_controller(game, hiddens, learning_rate, discount_rate, seed=None):
+    """Create DiscreteDeepQ with MLP brain, as in Reinforcement_Learning_Tutorial.
+
+    If seed is given, initial weights, exploration and replay
+    sampling are the same in every run."""
+    import tensorflow as tf
+    from tf_rl.controller import DiscreteDeepQ
+    from tf_rl.models import MLP
+    from tf_rl.utils.seeding import spawn_rngs
+
+    model_rng, controller_rng = spawn_rngs(seed, 2)
+    session = tf.Session()
+    brain = MLP([game.observation_size,], list(hiddens) + [game.num_actions],
+                [tf.tanh] * len(hiddens) + [tf.identity], seed=model_rng)
+    optimizer = tf.train.RMSPropOptimizer(learning_rate=learning_rate, decay=0.9)
+    controller = DiscreteDeepQ(game.observation_size, game.num_actions, brain, optimizer, session,
+                               discount_rate=discount_rate, exploration_period=5000, max_experience=10000,
+                               store_every_nth=4, train_every_nth=4, seed=controller_rng)
+    session.run(tf.global_variables_initializer())
+    session.run(controller.target_network_update)
+    return controller
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run Karpathy game without visualization.")
+    parser.add_argument("--frames", type=int, default=None, help="number of frames to simulate")
+    parser.add_argument("--episodes", type=int, default=None, help="number of episodes to simulate")
+    parser.add_argument("--frames-per-episode", type=int, default=1000)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--action-every", type=int, default=3)
+    parser.add_argument("--simulation-resolution", type=float, default=None)
+    parser.add_argument("--engine", choices=["objects", "arrays"], default="objects",
+                        help="KarpathyGame or ArrayKarpathyGame")
+    parser.add_argument("--vectorized-observation", action="store_true")
+    parser.add_argument("--num-objects", type=int, default=None,
+                        help="number of objects of every type")
+    parser.add_argument("--controller", choices=["random", "deepq"], default="deepq")
+    parser.add_argument("--hiddens", type=int, nargs="*", default=[200, 200])
+    parser.add_argument("--learning-rate", type=float, default=0.001)
+    parser.add_argument("--discount-rate", type=float, default=0.99)
+    parser.add_argument("--disable-training", action="store_true")
+    parser.add_argument("--record-path", default=None,
+                        help="record trajectory to this file (see tf_rl.simulation.render)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed of the game, the controller and the network")
+    args = parser.parse_args(argv)
+
+    if args.frames is None and args.episodes is None:
+        parser.error("one of --frames and --episodes is required")
+
+    from tf_rl.simulation import KarpathyGame, ArrayKarpathyGame, DEFAULT_SETTINGS
+    from tf_rl.controller import RandomController
+    from tf_rl.utils.seeding import spawn_rngs
+
+    settings = copy.deepcopy(DEFAULT_SETTINGS)
+    settings["vectorized_observation"] = args.vectorized_observation
+    if args.num_objects is not None:
+        settings["num_objects"] = {obj_type: args.num_objects for obj_type in settings["objects"]}
+
+    game_class = ArrayKarpathyGame if args.engine == "arrays" else KarpathyGame
+    game_rng, controller_rng = spawn_rngs(args.seed, 2)
+    game = game_class(settings, seed=game_rng)
+
+    if args.controller == "random":
+        controller = RandomController(game.num_actions, seed=controller_rng)
+    else:
+        controller = make_deepq_controller(game, args.hiddens, args.learning_rate, args.discount_rate,
+                                           seed=controller_rng)
+
+    stats = run_headless(game, controller,
+                         num_frames=args.frames,
+                         num_episodes=args.episodes,
+                         frames_per_episode=args.frames_per_episode,
+                         fps=args.fps,
+                         action_every=args.action_every,
+                         simulation_resolution=args.simulation_resolution,
+                         disable_training=args.disable_training,
+                         record_path=args.record_path)
+    print(json.dumps(stats, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,35 @@
 import math
 import tensorflow as tf
 
+from .numpy_models import NumpyMLP
 from .utils import base_name
+from .utils.seeding import make_rng, tf_seed
 
 
 class Layer(object):
-    def __init__(self, input_sizes, output_size, scope):
-        """Cretes a neural network layer."""
+    def __init__(self, input_sizes, output_size, scope, fused=False, seed=None):
+        """Cretes a neural network layer.
+
+        If fused is true, multiple inputs are concatenated and multiplied
+        by concatenated weights in a single matmul. Variables are the same
+        in both modes, so checkpoints are interchangeable.
+
+        seed is the operation level seed of the initializers (None - random)."""
         if type(input_sizes) != list:
             input_sizes = [input_sizes]
 
         self.input_sizes = input_sizes
         self.output_size = output_size
         self.scope       = scope or "Layer"
+        self.fused       = fused
 
         with tf.variable_scope(self.scope):
             self.Ws = []
             for input_idx, input_size in enumerate(input_sizes):
                 W_name = "W_%d" % (input_idx,)
                 W_initializer =  tf.random_uniform_initializer(
-                        -1.0 / math.sqrt(input_size), 1.0 / math.sqrt(input_size))
+                        -1.0 / math.sqrt(input_size), 1.0 / math.sqrt(input_size),
+                        seed=None if seed is None else seed + input_idx)
                 W_var = tf.get_variable(W_name, (input_size, output_size), initializer=W_initializer)
                 self.Ws.append(W_var)
             self.b = tf.get_variable("b", (output_size,), initializer=tf.constant_initializer(0))
@@ -30,6 +40,8 @@ class Layer(object):
         assert len(xs) == len(self.Ws), \
                 "Expected %d input vectors, got %d" % (len(self.Ws), len(xs))
         with tf.variable_scope(self.scope):
+            if self.fused and len(xs) > 1:
+                return tf.nn.bias_add(tf.matmul(tf.concat(xs, 1), tf.concat(self.Ws, 0)), self.b)
             return sum([tf.matmul(x, W) for x, W in zip(xs, self.Ws)]) + self.b
 
     def variables(self):
@@ -43,11 +55,28 @@ class Layer(object):
                 tf.get_variable(base_name(v), v.get_shape(),
                         initializer=lambda x,dtype=tf.float32, partition_info=None: v.initialized_value())
             sc.reuse_variables()
-            return Layer(self.input_sizes, self.output_size, scope=sc)
+            return Layer(self.input_sizes, self.output_size, scope=sc, fused=self.fused)
 
 class MLP(object):
-    def __init__(self, input_sizes, hiddens, nonlinearities, scope=None, given_layers=None):
+    def __init__(self, input_sizes, hiddens, nonlinearities, scope=None, given_layers=None, fused=False, dueling=False,
+                 seed=None):
+        """Creates multi layer perceptron. If fused is true, multiple
+        inputs of the input layer are multiplied by a single matmul.
+
+        If dueling is true, the last layer is split into a state value
+        stream V and an advantage stream A (both computed from the
+        second to last hidden layer) and the output is
+            Q = V + A - mean(A)
+        Based on:
+            https://arxiv.org/abs/1511.06581
+
+        If seed (int or np.random.Generator) is given, every layer
+        gets initializer seed drawn from it, so the initial weights
+        are the same in every run.
+        """
         self.input_sizes = input_sizes
+        self.fused       = fused
+        self.dueling     = dueling
         # observation is 5 features(distance of each object and X,Y speed) of closest 32 object with hero(friend, enemy, wall) + 2 hero's own speed X,Y
         # ==> 5*32 + 2 = 162 features about the game
         self.hiddens = hiddens
@@ -56,25 +85,42 @@ class MLP(object):
 
         assert len(hiddens) == len(nonlinearities), \
                 "Number of hiddens must be equal to number of nonlinearities"
+        assert not dueling or len(hiddens) >= 2, \
+                "Dueling network needs at least one hidden layer"
 
         with tf.variable_scope(self.scope):
             if given_layers is not None:
+                if dueling:
+                    given_layers, self.value_layer = given_layers[:-1], given_layers[-1]
                 self.input_layer = given_layers[0]
                 self.layers      = given_layers[1:]
             else:
-                self.input_layer = Layer(input_sizes, hiddens[0], scope="input_layer") # 135 -> 200
+                rng = make_rng(seed) if seed is not None else None
+                layer_seed = lambda: None if rng is None else tf_seed(rng)
+                self.input_layer = Layer(input_sizes, hiddens[0], scope="input_layer", fused=fused,
+                                         seed=layer_seed()) # 135 -> 200
                 self.layers = []
 
                 for l_idx, (h_from, h_to) in enumerate(zip(hiddens[:-1], hiddens[1:])): # hiddens == [200, 200, 4], so this mean, swifting the index by 1
                     # (200, 200) , (200,4)
-                    self.layers.append(Layer(h_from, h_to, scope="hidden_layer_%d" % (l_idx,)))
+                    self.layers.append(Layer(h_from, h_to, scope="hidden_layer_%d" % (l_idx,), seed=layer_seed()))
                     # this has 4 layers
+                if dueling:
+                    # state value computed from the same hidden layer as advantages (the last one in self.layers)
+                    self.value_layer = Layer(hiddens[-2], 1, scope="value_layer", seed=layer_seed())
 
     def __call__(self, xs):
         if type(xs) != list:
             xs = [xs]
         with tf.variable_scope(self.scope):
             hidden = self.input_nonlinearity(self.input_layer(xs))
+            if self.dueling:
+                for layer, nonlinearity in zip(self.layers[:-1], self.layer_nonlinearities[:-1]):
+                    hidden = nonlinearity(layer(hidden))
+                output_nonlinearity = self.layer_nonlinearities[-1]
+                value      = output_nonlinearity(self.value_layer(hidden))
+                advantages = output_nonlinearity(self.layers[-1](hidden))
+                return value + advantages - tf.reduce_mean(advantages, axis=1, keep_dims=True)
             for layer, nonlinearity in zip(self.layers, self.layer_nonlinearities):
                 hidden = nonlinearity(layer(hidden))
             return hidden
@@ -83,11 +129,27 @@ class MLP(object):
         res = self.input_layer.variables()
         for layer in self.layers:
             res.extend(layer.variables())
+        if self.dueling:
+            res.extend(self.value_layer.variables())
         return res
 
+    def to_numpy(self, session):
+        """Return NumpyMLP with current weights of this network"""
+        layers = session.run([(layer.Ws, layer.b) for layer in [self.input_layer] + self.layers])
+        nonlinearities = [f.__name__ for f in [self.input_nonlinearity] + self.layer_nonlinearities]
+        value_layer = session.run((self.value_layer.Ws, self.value_layer.b)) if self.dueling else None
+        return NumpyMLP(layers, nonlinearities, value_layer=value_layer)
+
+    def export_numpy(self, session, path):
+        """Save current weights to .npz file loadable with
+        NumpyMLP.load, without TensorFlow"""
+        self.to_numpy(session).save(path)
+
     def copy(self, scope=None):
         scope = scope or self.scope + "_copy"
         nonlinearities = [self.input_nonlinearity] + self.layer_nonlinearities
         given_layers = [self.input_layer.copy()] + [layer.copy() for layer in self.layers]
+        if self.dueling:
+            given_layers.append(self.value_layer.copy())
         return MLP(self.input_sizes, self.hiddens, nonlinearities, scope=scope,
-                given_layers=given_layers)
\ No newline at end of file
+                given_layers=given_layers, fused=self.fused, dueling=self.dueling)
\ No newline at end of file
@@ -0,0 +1,98 @@
+"""
+NumPy-only runtime for networks exported from tf_rl.models.
+
+This module must not import TensorFlow, so that processes that only
+need inference (actors, serving) start instantly.
+"""
+import numpy as np
+
+NONLINEARITIES = {
+    "identity": lambda x: x,
+    "tanh":     np.tanh,
+    "relu":     lambda x: np.maximum(x, 0),
+    "sigmoid":  lambda x: 1.0 / (1.0 + np.exp(-x)),
+}
+
+def dense(xs, Ws, b, nonlinearity):
+    """Apply layer with weights Ws, b to inputs xs"""
+    return NONLINEARITIES[nonlinearity](sum([x.dot(W) for x, W in zip(xs, Ws)]) + b)
+
+class NumpyMLP(object):
+    def __init__(self, layers, nonlinearities, value_layer=None):
+        """Multi layer perceptron evaluated with numpy.
+
+        Parameters
+        -------
+        layers: list of (Ws, b)
+            weights of every layer - list of matrices, one
+            per input, and a bias vector
+        nonlinearities: list of str
+            name of nonlinearity of every layer,
+            one of NONLINEARITIES
+        value_layer: (Ws, b) or None
+            state value layer of a dueling network
+            (see tf_rl.models.MLP), applied to the same
+            input as the last layer.
+        """
+        assert len(layers) == len(nonlinearities), \
+                "Number of layers must be equal to number of nonlinearities"
+        for name in nonlinearities:
+            assert name in NONLINEARITIES, "Unsupported nonlinearity %s" % (name,)
+        self.layers         = [([np.asarray(W) for W in Ws], np.asarray(b)) for Ws, b in layers]
+        self.nonlinearities = list(nonlinearities)
+        self.value_layer    = None
+        if value_layer is not None:
+            Ws, b = value_layer
+            self.value_layer = ([np.asarray(W) for W in Ws], np.asarray(b))
+
+    def __call__(self, xs):
+        """Same as tf_rl.models.MLP.__call__ - xs is a batch
+        or a list of batches, one for every input"""
+        if type(xs) != list:
+            xs = [xs]
+        hidden = xs
+        layers = self.layers if self.value_layer is None else self.layers[:-1]
+        for (Ws, b), nonlinearity in zip(layers, self.nonlinearities):
+            hidden = [dense(hidden, Ws, b, nonlinearity)]
+        if self.value_layer is not None:
+            value      = dense(hidden, self.value_layer[0], self.value_layer[1], self.nonlinearities[-1])
+            advantages = dense(hidden, self.layers[-1][0], self.layers[-1][1], self.nonlinearities[-1])
+            return value + advantages - advantages.mean(axis=1, keepdims=True)
+        return hidden[0]
+
+    def predict_actions(self, observations):
+        """Index of the highest scoring action for every observation"""
+        return np.argmax(self(np.asarray(observations, dtype=np.float32)), axis=1)
+
+    def save(self, path):
+        """Save to .npz file"""
+        arrays = {"nonlinearities": np.array(self.nonlinearities)}
+        for layer_idx, (Ws, b) in enumerate(self.layers):
+            arrays["layer_%d/b" % (layer_idx,)] = b
+            for input_idx, W in enumerate(Ws):
+                arrays["layer_%d/W_%d" % (layer_idx, input_idx)] = W
+        if self.value_layer is not None:
+            Ws, b = self.value_layer
+            arrays["value_layer/b"] = b
+            for input_idx, W in enumerate(Ws):
+                arrays["value_layer/W_%d" % (input_idx,)] = W
+        np.savez(path, **arrays)
+
+    @staticmethod
+    def load(path):
+        """Load NumpyMLP saved with save"""
+        with np.load(path) as f:
+            nonlinearities = [str(name) for name in f["nonlinearities"]]
+            layers = []
+            for layer_idx in range(len(nonlinearities)):
+                Ws = []
+                while "layer_%d/W_%d" % (layer_idx, len(Ws)) in f.files:
+                    Ws.append(f["layer_%d/W_%d" % (layer_idx, len(Ws))])
+                layers.append((Ws, f["layer_%d/b" % (layer_idx,)]))
+            value_layer = None
+            if "value_layer/b" in f.files:
+                Ws = []
+                while "value_layer/W_%d" % (len(Ws),) in f.files:
+                    Ws.append(f["value_layer/W_%d" % (len(Ws),)])
+                value_layer = (Ws, f["value_layer/b"])
+        return NumpyMLP(layers, nonlinearities, value_layer=value_layer)
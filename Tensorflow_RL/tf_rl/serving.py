@@ -0,0 +1,311 @@
+"""
+Low latency serving of trained Q-networks.
+
+PolicyServer collects concurrent observation requests into dynamic
+micro-batches - a batch is evaluated as soon as it is full or the
+oldest request waited for max_latency_ms - and answers every
+request with its action. Requests can be made in-process (predict),
+or over TCP / Unix sockets using PolicyClient.
+
+Wire protocol: client sends uint32 number of floats followed by that
+many float32 values of the observation, server answers with int32 action.
+Server closes the connection if the observation has the wrong size or
+its evaluation failed.
+"""
+import argparse
+import numpy as np
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+class PendingRequest(object):
+    """Observation waiting for its action"""
+    def __init__(self, observation):
+        self.observation  = observation
+        self.arrival_time = time.time()
+        self.action       = None
+        self.error        = None
+        self.done         = threading.Event()
+
+class PolicyServer(object):
+    def __init__(self, predict_fn, max_batch_size=64, max_latency_ms=2.0, metrics_window=10000,
+                 observation_size=None):
+        """Serves predict_fn with dynamic micro-batching.
+
+        Parameters
+        -------
+        predict_fn: function
+            maps [batch_size, observation_size] array
+            of observations to [batch_size] actions
+        max_batch_size: int
+            maximum number of observations evaluated at once
+        max_latency_ms: float
+            how long the first request of a batch may wait
+            for more requests to arrive
+        metrics_window: int
+            number of most recent requests and batches
+            used to compute metrics
+        observation_size: int
+            if given, observations of other sizes are
+            rejected before they are batched
+        """
+        self.predict_fn     = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency_s  = max_latency_ms / 1000.0
+        self.observation_size = observation_size
+
+        self.requests   = queue.Queue()
+        self.latencies  = np.zeros(metrics_window)
+        self.batch_sizes = np.zeros(metrics_window, dtype=np.int64)
+        self.num_requests = 0
+        self.num_batches  = 0
+        self.metrics_lock = threading.Lock()
+
+        self.stopped = threading.Event()
+        # requests are only queued while the server runs, see stop
+        self.stop_lock = threading.Lock()
+        self.batcher = threading.Thread(target=self.batching_loop)
+        self.batcher.daemon = True
+        self.batcher.start()
+        self.socket_servers = []
+
+    def batching_loop(self):
+        while not self.stopped.is_set():
+            try:
+                batch = [self.requests.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            deadline = batch[0].arrival_time + self.max_latency_s
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.time()
+                try:
+                    if remaining > 0:
+                        batch.append(self.requests.get(timeout=remaining))
+                    else:
+                        batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+
+            # every request of the batch must be answered, even if evaluation fails,
+            # otherwise their predict calls would wait forever.
+            try:
+                actions = self.predict_fn(np.stack([request.observation for request in batch]))
+                for request, action in zip(batch, actions):
+                    request.action = int(action)
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            finally:
+                finished_time = time.time()
+                for request in batch:
+                    request.done.set()
+            self.record(batch, finished_time)
+
+    def record(self, batch, finished_time):
+        with self.metrics_lock:
+            window = len(self.latencies)
+            for request in batch:
+                self.latencies[self.num_requests % window] = finished_time - request.arrival_time
+                self.num_requests += 1
+            self.batch_sizes[self.num_batches % len(self.batch_sizes)] = len(batch)
+            self.num_batches += 1
+
+    def predict(self, observation):
+        """Return action for a single observation. Blocks until
+        the micro-batch containing it is evaluated.
+
+        Raises ValueError if observation has wrong size, RuntimeError
+        if the server is stopped and the exception raised by predict_fn
+        if evaluation of the micro-batch failed."""
+        request = PendingRequest(np.asarray(observation, dtype=np.float32))
+        self.check_observation(request.observation)
+        with self.stop_lock:
+            if self.stopped.is_set():
+                raise RuntimeError("policy server is stopped")
+            self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.action
+
+    def check_observation(self, observation):
+        if observation.ndim != 1 or (self.observation_size is not None and
+                                     observation.shape[0] != self.observation_size):
+            raise ValueError("expected observation of size %s, got shape %s" % (
+                    self.observation_size, observation.shape))
+
+    def metrics(self):
+        """Latency percentiles (in milliseconds) and batch size statistics
+        over the most recent requests"""
+        with self.metrics_lock:
+            latencies   = self.latencies[:min(self.num_requests, len(self.latencies))]
+            batch_sizes = self.batch_sizes[:min(self.num_batches, len(self.batch_sizes))]
+            if len(latencies) == 0:
+                return {"requests": 0, "batches": 0}
+            return {
+                "requests":        self.num_requests,
+                "batches":         self.num_batches,
+                "latency_p50_ms":  1000.0 * float(np.percentile(latencies, 50)),
+                "latency_p99_ms":  1000.0 * float(np.percentile(latencies, 99)),
+                "mean_batch_size": float(np.mean(batch_sizes)),
+                "max_batch_size":  int(np.max(batch_sizes)),
+            }
+
+    def serve(self, address):
+        """Start answering requests on address in a background thread.
+        Address is a (host, port) tuple for TCP or a path for Unix socket.
+        Returns the underlying socketserver."""
+        policy_server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while True:
+                    header = recv_exactly(self.request, 4)
+                    if header is None:
+                        return
+                    size, = struct.unpack("!I", header)
+                    # reject before reading the body, size may be garbage.
+                    if policy_server.observation_size is not None and size != policy_server.observation_size:
+                        return
+                    body = recv_exactly(self.request, 4 * size)
+                    if body is None:
+                        return
+                    try:
+                        action = policy_server.predict(np.frombuffer(body, dtype=">f4"))
+                    except Exception:
+                        return
+                    self.request.sendall(struct.pack("!i", action))
+
+        if isinstance(address, tuple):
+            server_class = ThreadingTCPServer
+        else:
+            server_class = ThreadingUnixServer
+        server = server_class(address, Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.socket_servers.append(server)
+        return server
+
+    def stop(self):
+        """Stop serving. Requests that were not evaluated yet fail with RuntimeError."""
+        for server in self.socket_servers:
+            server.shutdown()
+            server.server_close()
+        with self.stop_lock:
+            self.stopped.set()
+        self.batcher.join()
+
+        # no request is queued after stopped was set, so the queue
+        # can be drained once batcher exited.
+        error = RuntimeError("policy server was stopped")
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            request.error = error
+            request.done.set()
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def recv_exactly(sock, num_bytes):
+    """Read num_bytes from sock, returns None if connection was closed"""
+    chunks = []
+    while num_bytes > 0:
+        chunk = sock.recv(num_bytes)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        num_bytes -= len(chunk)
+    return b"".join(chunks)
+
+class PolicyClient(object):
+    def __init__(self, address):
+        """Connect to PolicyServer serving on address
+        ((host, port) tuple or Unix socket path)"""
+        if isinstance(address, tuple):
+            self.sock = socket.create_connection(address)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(address)
+
+    def action(self, observation):
+        observation = np.asarray(observation, dtype=">f4")
+        self.sock.sendall(struct.pack("!I", observation.size) + observation.tobytes())
+        response = recv_exactly(self.sock, 4)
+        if response is None:
+            raise ConnectionError("server rejected the observation or failed to evaluate it")
+        action, = struct.unpack("!i", response)
+        return action
+
+    def close(self):
+        self.sock.close()
+
+def checkpoint_predict_fn(checkpoint_path, observation_size, hiddens, nonlinearities, scope=None, dueling=False):
+    """Load MLP Q-network from checkpoint and return function mapping
+    observations to predicted actions.
+
+    hiddens, nonlinearities, scope and dueling must be the same as those of the
+    trained tf_rl.models.MLP (scope defaults to "MLP")."""
+    import tensorflow as tf
+    from tf_rl.models import MLP
+
+    graph = tf.Graph()
+    with graph.as_default():
+        brain = MLP([observation_size,], hiddens, nonlinearities, scope=scope, dueling=dueling)
+        observation = tf.placeholder(tf.float32, (None, observation_size), name="observation")
+        predicted_actions = tf.argmax(brain(observation), axis=1)
+        session = tf.Session(graph=graph)
+        tf.train.Saver(var_list=brain.variables()).restore(session, checkpoint_path)
+
+    def predict_fn(observations):
+        return session.run(predicted_actions, {observation: observations})
+    return predict_fn
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve trained MLP Q-network.")
+    parser.add_argument("checkpoint", help="path of checkpoint saved with tf.train.Saver")
+    parser.add_argument("--observation-size", type=int, required=True)
+    parser.add_argument("--hiddens", type=int, nargs="+", required=True,
+                        help="layer sizes including the output layer")
+    parser.add_argument("--dueling", action="store_true",
+                        help="network was created with dueling head")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--unix-socket", default=None)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-latency-ms", type=float, default=2.0)
+    parser.add_argument("--report-every", type=float, default=10.0,
+                        help="print metrics every that many seconds")
+    args = parser.parse_args(argv)
+
+    import tensorflow as tf
+    nonlinearities = [tf.tanh] * (len(args.hiddens) - 1) + [tf.identity]
+    predict_fn = checkpoint_predict_fn(args.checkpoint, args.observation_size, args.hiddens, nonlinearities,
+                                       dueling=args.dueling)
+
+    server = PolicyServer(predict_fn, args.max_batch_size, args.max_latency_ms,
+                          observation_size=args.observation_size)
+    if args.unix_socket is not None:
+        server.serve(args.unix_socket)
+    else:
+        server.serve((args.host, args.port or 7777))
+    try:
+        while True:
+            time.sleep(args.report_every)
+            print(server.metrics())
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
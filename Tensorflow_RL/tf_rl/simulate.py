@@ -1,11 +1,132 @@
 import math
+import numpy as np
 import time
 
-from IPython.display import clear_output, display, HTML
 from itertools import count
 from os.path import join, exists
 from os import makedirs
 
+def simulation_chunks(fps, simulation_resolution=None):
+    """Return number of simulation steps per frame and length
+    of every step in seconds."""
+    chunks_per_frame = 1
+    chunk_length_s   = 1.0 / fps
+
+    if simulation_resolution is not None:
+        frame_length_s = 1.0 / fps
+        chunks_per_frame = int(math.ceil(frame_length_s / simulation_resolution))
+        chunks_per_frame = max(chunks_per_frame, 1)
+        chunk_length_s = frame_length_s / chunks_per_frame
+    return chunks_per_frame, chunk_length_s
+
+def close_controller(controller):
+    """Let controller persist its experience when the simulation stops.
+    Controllers that do not implement close are left alone."""
+    if hasattr(controller, "close"):
+        controller.close()
+
+def batch_actions(controller, observations):
+    """Ask controller for actions for a batch of observations.
+
+    Controllers that only implement action are queried one
+    observation at a time."""
+    if hasattr(controller, "batch_action"):
+        return controller.batch_action(observations)
+    return np.array([controller.action(observation) for observation in observations])
+
+class FrameStepper(object):
+    def __init__(self, simulation, controller,
+                       fps=60,
+                       action_every=1,
+                       simulation_resolution=None,
+                       disable_training=False,
+                       vectorized=False,
+                       record_path=None):
+        """Advances simulation frame by frame and lets controller act in it.
+        Used by simulate, simulate_vectorized, tf_rl.headless and actors
+        of tf_rl.distributed.
+
+        Parameters
+        -------
+        simulation: tr_lr.simulation
+            simulation that will be simulated
+        controller: tr_lr.controller
+            controller used
+        fps, action_every, simulation_resolution, disable_training, record_path:
+            same as in simulate
+        vectorized: bool
+            simulation is vectorized environment (for example
+            tf_rl.simulation.VecKarpathyGame). Transitions of game i
+            are stored as stream i and actions of all the games
+            are chosen at once.
+        """
+        self.simulation       = simulation
+        self.controller       = controller
+        self.action_every     = action_every
+        self.disable_training = disable_training
+        self.vectorized       = vectorized
+        self.chunks_per_frame, self.chunk_length_s = simulation_chunks(fps, simulation_resolution)
+
+        # state transition bookkeeping
+        self.last_observation = None
+        self.last_action      = None
+
+        self.recorder = None
+        if record_path is not None:
+            from tf_rl.simulation.trajectory import TrajectoryRecorder
+            self.recorder = TrajectoryRecorder(record_path, simulation)
+
+    def step(self, frame_no):
+        """Simulate frame_no-th frame. Every action_every-th frame the last
+        transition is stored, controller chooses an action and trains.
+
+        Returns reward collected in this frame (array with reward of every
+        game if vectorized) or None if no action was taken."""
+        for _ in range(self.chunks_per_frame):
+            self.simulation.step(self.chunk_length_s)
+
+        reward = None
+        if frame_no % self.action_every == 0:
+            new_observation = self.simulation.observe()
+            reward          = self.simulation.collect_reward()
+            # store last transition
+            if self.last_observation is not None:
+                self.store(reward, new_observation)
+
+            # act
+            if self.vectorized:
+                new_action = batch_actions(self.controller, new_observation)
+            else:
+                new_action = self.controller.action(new_observation) # determine the action
+            self.simulation.perform_action(new_action) # perform that action
+
+            #train
+            if not self.disable_training:
+                self.controller.training_step()
+
+            # update current state as last state.
+            self.last_action      = new_action
+            self.last_observation = new_observation
+
+        if self.recorder is not None:
+            self.recorder.record(frame_no)
+        return reward
+
+    def store(self, reward, new_observation):
+        if self.vectorized:
+            for i in range(self.simulation.num_envs):
+                self.controller.store(self.last_observation[i], self.last_action[i], reward[i], new_observation[i],
+                                      stream=i)
+        else:
+            self.controller.store(self.last_observation, self.last_action, reward, new_observation)
+
+    def close(self):
+        """Close trajectory recorder and controller"""
+        if self.recorder is not None:
+            self.recorder.close()
+        close_controller(self.controller)
+
+
 def simulate(simulation,
              controller= None,
              fps=60,
@@ -14,7 +135,8 @@ def simulate(simulation,
              simulation_resolution=None,
              wait=False,
              disable_training=False,
-             save_path=None):
+             save_path=None,
+             record_path=None):
     """Start the simulation. Performs three tasks
 
         - visualizes simulation in iPython notebook
@@ -45,67 +167,110 @@ def simulate(simulation,
     save_path: str
         save svg visualization (only tl_rl.utils.svg
         supported for the moment)
+    record_path: str
+        record every frame to this file with
+        tf_rl.simulation.trajectory.TrajectoryRecorder. Much cheaper
+        than save_path - recorded frames can be rendered to svg
+        later with tf_rl.simulation.render.
     """
 
+    # imported here, so that headless runs do not need IPython.
+    from IPython.display import clear_output, display
+
     # prepare path to save simulation images
     if save_path is not None:
         if not exists(save_path):
             makedirs(save_path)
     last_image = 0
 
-    # calculate simulation times
-    chunks_per_frame = 1
-    chunk_length_s   = 1.0 / fps
+    stepper = FrameStepper(simulation, controller, fps, action_every, simulation_resolution,
+                           disable_training, record_path=record_path)
 
-    if simulation_resolution is not None:
-        frame_length_s = 1.0 / fps
-        chunks_per_frame = int(math.ceil(frame_length_s / simulation_resolution))
-        chunks_per_frame = max(chunks_per_frame, 1)
-        chunk_length_s = frame_length_s / chunks_per_frame
+    simulation_started_time = time.time()
 
-    # state transition bookkeeping
-    last_observation = None
-    last_action      = None
+    try:
+        for frame_no in count():
+            stepper.step(frame_no)
 
-    simulation_started_time = time.time()
+            # adding 1 to make it less likely to happen at the same time as
+            # action taking.
+            if (frame_no + 1) % visualize_every == 0:
+                fps_estimate = frame_no / (time.time() - simulation_started_time)
+                clear_output(wait=True)
+                svg_html = simulation.to_html(["fps = %.1f" % (fps_estimate,)])
+                display(svg_html)
+                if save_path is not None:
+                    img_path = join(save_path, "%d.svg" % (last_image,))
+                    with open(img_path, "w") as f:
+                        svg_html.write_svg(f)
+                    last_image += 1
 
-    for frame_no in count():
-        for _ in range(chunks_per_frame):
-            simulation.step(chunk_length_s)
+            time_should_have_passed = frame_no / fps
+            time_passed = (time.time() - simulation_started_time)
+            if wait and (time_should_have_passed > time_passed):
+                time.sleep(time_should_have_passed - time_passed)
+    finally:
+        # simulation is usually stopped with KeyboardInterrupt.
+        stepper.close()
 
-        if frame_no % action_every == 0:
-            new_observation = simulation.observe()
-            reward          = simulation.collect_reward()
-            # store last transition
-            if last_observation is not None:
-                controller.store(last_observation, last_action, reward, new_observation)
 
-            # act
-            new_action = controller.action(new_observation) # determine the action
-            simulation.perform_action(new_action) # perform that action
+def simulate_vectorized(simulation,
+                        controller,
+                        fps=60,
+                        visualize_every=1,
+                        action_every=1,
+                        simulation_resolution=None,
+                        wait=False,
+                        disable_training=False):
+    """Start the simulation of many games in lockstep.
 
-            #train
-            if not disable_training:
-                controller.training_step()
+    Same as simulate, but simulation is a vectorized environment
+    (for example tf_rl.simulation.VecKarpathyGame) that observes
+    all the games as a single [num_envs, observation_size] array
+    and takes a batch of actions. Transitions of every game are
+    stored in the controller (game i as stream i) and only the
+    first game is visualized.
 
-            # update current state as last state.
-            last_action = new_action
-            last_observation = new_observation
-
-        # adding 1 to make it less likely to happen at the same time as
-        # action taking.
-        if (frame_no + 1) % visualize_every == 0:
-            fps_estimate = frame_no / (time.time() - simulation_started_time)
-            clear_output(wait=True)
-            svg_html = simulation.to_html(["fps = %.1f" % (fps_estimate,)])
-            display(svg_html)
-            if save_path is not None:
-                img_path = join(save_path, "%d.svg" % (last_image,))
-                with open(img_path, "w") as f:
-                    svg_html.write_svg(f)
-                last_image += 1
-
-        time_should_have_passed = frame_no / fps
-        time_passed = (time.time() - simulation_started_time)
-        if wait and (time_should_have_passed > time_passed):
-            time.sleep(time_should_have_passed - time_passed)
+    Parameters
+    -------
+    simulation: tr_lr.simulation.VecKarpathyGame
+        games that will be simulated
+    controller: tr_lr.controller
+        controller used
+    fps: int
+        frames per seconds
+    visualize_every: int
+        visualize every `visualize_every`-th frame.
+    action_every: int
+        take action every `action_every`-th frame
+    simulation_resolution: float
+        simulate at most 'simulation_resolution' seconds at a time.
+        If None, the it is set to 1/FPS (default).
+    wait: boolean
+        whether to intentionally slow down the simulation
+        to appear real time.
+    disable_training: bool
+        if true training_step is never called.
+    """
+    from IPython.display import clear_output, display
+
+    stepper = FrameStepper(simulation, controller, fps, action_every, simulation_resolution,
+                           disable_training, vectorized=True)
+
+    simulation_started_time = time.time()
+
+    try:
+        for frame_no in count():
+            stepper.step(frame_no)
+
+            if (frame_no + 1) % visualize_every == 0:
+                fps_estimate = frame_no / (time.time() - simulation_started_time)
+                clear_output(wait=True)
+                display(simulation.to_html(["fps = %.1f" % (fps_estimate,)]))
+
+            time_should_have_passed = frame_no / fps
+            time_passed = (time.time() - simulation_started_time)
+            if wait and (time_should_have_passed > time_passed):
+                time.sleep(time_should_have_passed - time_passed)
+    finally:
+        stepper.close()
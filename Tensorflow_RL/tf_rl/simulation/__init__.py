@@ -1,3 +1,5 @@
-from .karpathy_game   import KarpathyGame
+from .karpathy_game   import KarpathyGame, DEFAULT_SETTINGS
+from .array_karpathy_game import ArrayKarpathyGame
+from .vec_karpathy_game import VecKarpathyGame
 #from .double_pendulum import DoublePendulum
 #from .discrete_hill   import DiscreteHill
@@ -0,0 +1,113 @@
+import numpy as np
+
+from euclid import Point2, Vector2
+
+from .karpathy_game import KarpathyGame, GameObject
+
+class ArrayKarpathyGame(KarpathyGame):
+    def __init__(self, settings, seed=None):
+        """Karpathy game simulated on structure-of-arrays state.
+
+        Positions, speeds and types of all the objects (except the hero)
+        are stored in contiguous numpy arrays, so that wall bouncing,
+        movement and detection of collisions with the hero are a handful
+        of array operations per step instead of python loops over
+        GameObjects. Random numbers are drawn in exactly the same order
+        as in KarpathyGame, so with the same seed both games evolve
+        identically.
+
+        `objects` is exposed as a list of GameObjects built from the
+        arrays - it is a snapshot, modifying it does not change the game.
+        """
+        self.object_types = list(settings["objects"])
+        self.positions = np.zeros((0, 2))
+        self.speeds    = np.zeros((0, 2))
+        self.types     = np.zeros((0,), dtype=np.int32)
+        super(ArrayKarpathyGame, self).__init__(settings, seed)
+
+    @property
+    def objects(self):
+        return [GameObject(Point2(*position), Vector2(*speed), self.object_types[type_id], self.settings)
+                for position, speed, type_id in zip(self.positions.tolist(), self.speeds.tolist(), self.types)]
+
+    @objects.setter
+    def objects(self, objects):
+        """Replace all the objects with given GameObjects"""
+        self.positions = np.array([tuple(obj.position) for obj in objects], dtype=np.float64).reshape(-1, 2)
+        self.speeds    = np.array([tuple(obj.speed)    for obj in objects], dtype=np.float64).reshape(-1, 2)
+        self.types     = np.array([self.object_types.index(obj.obj_type) for obj in objects], dtype=np.int32)
+
+    def create_spatial_index(self):
+        """Arrays of all the objects are filtered with vectorized
+        operations, which is cheaper than maintaining a grid."""
+        return None
+
+    def object_arrays(self, objects=None):
+        """Return positions, speeds and type ids of all the objects.
+
+        Arrays are returned directly, without copying."""
+        if objects is not None:
+            return super(ArrayKarpathyGame, self).object_arrays(objects)
+        return self.positions, self.speeds, self.types
+
+    def spawn_object(self, obj_type):
+        """Spawn object of a given type and add it to the objects arrays"""
+        self.spawn_objects([obj_type])
+
+    def spawn_objects(self, obj_types):
+        """Spawn objects of given types, in order, with a single
+        append to the objects arrays"""
+        radius    = self.settings["object_radius"]
+        max_speed = np.array(self.settings["maximum_speed"])
+        positions, speeds = [], []
+        # one object at a time, to draw random numbers in the same order as KarpathyGame.
+        for _ in obj_types:
+            positions.append(self.rng.uniform([radius, radius], np.array(self.size) - radius))
+            speeds.append(self.rng.uniform(-max_speed, max_speed).astype(float))
+        type_ids = [self.object_types.index(obj_type) for obj_type in obj_types]
+
+        self.positions = np.concatenate([self.positions, np.array(positions, dtype=np.float64).reshape(-1, 2)])
+        self.speeds    = np.concatenate([self.speeds,    np.array(speeds,    dtype=np.float64).reshape(-1, 2)])
+        self.types     = np.concatenate([self.types,     np.array(type_ids,  dtype=np.int32)])
+
+    def step(self, dt):
+        """Simulate all the objects for a given ammount of time.
+
+        Also resolve collisions with the hero"""
+        self.wall_collisions()
+        self.positions += dt * self.speeds
+        self.hero.step(dt)
+
+        self.resolve_collisions()
+
+    def wall_collisions(self):
+        """Update speeds of all the objects colliding with the walls"""
+        radius     = self.settings["object_radius"]
+        world_size = np.array(self.size)
+
+        bounce = (((self.positions - radius <= 0) & (self.speeds < 0)) |
+                  ((self.positions + radius + 1 >= world_size) & (self.speeds > 0)))
+        self.speeds[bounce] = -self.speeds[bounce]
+
+    def resolve_collisions(self):
+        """If hero touches, hero eats. Also reward gets updated."""
+        collision_distance = 2 * self.settings["object_radius"]
+        collision_distance2 = collision_distance ** 2
+
+        delta = np.array([self.hero.position[0], self.hero.position[1]]) - self.positions
+        squared_distances = delta[:, 0] ** 2 + delta[:, 1] ** 2
+        eaten = np.flatnonzero(squared_distances < collision_distance2)
+        if len(eaten) == 0:
+            return
+
+        eaten_types = [self.object_types[type_id] for type_id in self.types[eaten]]
+        keep = np.ones(len(self.types), dtype=bool)
+        keep[eaten] = False
+        self.positions = self.positions[keep]
+        self.speeds    = self.speeds[keep]
+        self.types     = self.types[keep]
+
+        for obj_type in eaten_types:
+            self.objects_eaten[obj_type] += 1
+            self.object_reward += self.settings["object_reward"][obj_type]
+        self.spawn_objects(eaten_types)
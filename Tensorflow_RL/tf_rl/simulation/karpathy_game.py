@@ -9,13 +9,53 @@ from euclid import Circle, Point2, Vector2, LineSegment2
 
 import tf_rl.utils.svg as svg
 
+from tf_rl.utils.geometry import point_segment_distances, segment_circle_intersections, segment_intersections
+from tf_rl.utils.seeding import make_rng
+from tf_rl.utils.spatial_hash import SpatialHash
+
+# settings used in Reinforcement_Learning_Tutorial notebook
+DEFAULT_SETTINGS = {
+    'objects': [
+        'friend',
+        'enemy',
+    ],
+    'colors': {
+        'hero':   'yellow',
+        'friend': 'green',
+        'enemy':  'red',
+    },
+    'object_reward': {
+        'friend': 1,
+        'enemy': -1,
+    },
+    "num_objects": {
+        'friend' : 25,
+        'enemy' :  25,
+    },
+    'hero_bounces_off_walls': False,
+    'world_size': (700,500),
+    'hero_initial_position': [400, 300],
+    'hero_initial_speed':    [0,   0],
+    "maximum_speed":         [50, 50],
+    "object_radius": 10.0,
+    "num_observation_lines" : 32,
+    "observation_line_length": 240.,
+    "tolerable_distance_to_wall": 50,
+    "wall_distance_penalty":  -0.0,
+    "delta_v": 50,
+}
+
 class GameObject(object):
+    # objects are numerous, so they have no __dict__ and do not keep settings
+    __slots__ = ("position", "speed", "obj_type", "radius", "color", "world_size", "bounciness")
+
     # initialize the parameters of GameObject
     def __init__(self, position, speed, obj_type, settings):
         """Esentially represents circles of different kinds, which have
         position and speed."""
-        self.settings = settings
-        self.radius = self.settings["object_radius"]
+        self.radius     = settings["object_radius"]
+        self.color      = settings["colors"][obj_type]
+        self.world_size = settings["world_size"]
 
         self.obj_type = obj_type
         self.position = position
@@ -31,7 +71,7 @@ class GameObject(object):
     # wall collision check
     def wall_collisions(self):
         """Update speed upon collision with the wall."""
-        world_size = self.settings["world_size"]
+        world_size = self.world_size
 
         for dim in range(2): # check for X dim , Y dim
             if self.position[dim] - self.radius       <= 0               and self.speed[dim] < 0: # left , top check
@@ -41,9 +81,9 @@ class GameObject(object):
 
     # move this object
     def move(self, dt): # dt is the time. second
-        """Move as if dt seconds passed"""
-        self.position += dt * self.speed
-        self.position = Point2(*self.position) # 2 dimension point
+        """Move as if dt seconds passed. Position is updated in place."""
+        self.position.x += dt * self.speed.x
+        self.position.y += dt * self.speed.y
     
     # return itself as a circle type
     def as_circle(self):
@@ -52,14 +92,18 @@ class GameObject(object):
     # draw itself as a svg image
     def draw(self):
         """Return svg object for this item."""
-        color = self.settings["colors"][self.obj_type]
-        return svg.Circle(self.position + Point2(10, 10), self.radius, color=color)
+        return svg.Circle((self.position.x + 10, self.position.y + 10), self.radius, color=self.color)
 
     
 class KarpathyGame(object):
-    def __init__(self, settings):
-        """Initiallize game simulator with settings"""
+    def __init__(self, settings, seed=None):
+        """Initiallize game simulator with settings.
+
+        Objects are spawned using np.random.Generator created from
+        seed (see tf_rl.utils.seeding.make_rng), so games with the
+        same seed evolve identically."""
         self.settings = settings
+        self.rng      = make_rng(seed)
         self.size  = self.settings["world_size"]
         
         # make 4 walls
@@ -76,6 +120,9 @@ class KarpathyGame(object):
         if not self.settings["hero_bounces_off_walls"]:
             self.hero.bounciness = 0.0 # now hero has no bounciness
 
+        # optional grid index over object positions, see create_spatial_index
+        self.spatial_index = self.create_spatial_index()
+
         self.objects = []
         # spawn 25 friends, 25 enemy
         for obj_type, number in settings["num_objects"].items(): # 2 times run
@@ -84,6 +131,17 @@ class KarpathyGame(object):
 
         # generate 32 number of antennas
         self.observation_lines = self.generate_observation_lines()
+        # same antennas and walls as arrays, for vectorized observation
+        self.observation_starts = np.array([tuple(line.p1) for line in self.observation_lines])
+        self.observation_ends   = np.array([tuple(line.p2) for line in self.observation_lines])
+        self.wall_starts        = np.array([tuple(wall.p1) for wall in self.walls])
+        self.wall_ends          = np.array([tuple(wall.p2) for wall in self.walls])
+        # antennas as offsets from the hero, so that observe only adds hero position
+        self.observation_offsets = [(Vector2(*line.p1), Vector2(*line.p2)) for line in self.observation_lines]
+        # walls seen by the antennas at the last observed hero position, see wall_observation
+        self.wall_cache = None
+        # world frame is the same in every visualization
+        self.svg_frame          = svg.Static([svg.Rectangle((10, 10), self.size)])
 
         self.object_reward = 0
         self.collected_rewards = []
@@ -100,6 +158,14 @@ class KarpathyGame(object):
 
         self.objects_eaten = defaultdict(lambda: 0)
 
+    def create_spatial_index(self):
+        """Return SpatialHash with cells of settings["spatial_hash_cell_size"],
+        used to find objects near the hero, or None if it is not set."""
+        cell_size = self.settings.get("spatial_hash_cell_size")
+        if cell_size is None:
+            return None
+        return SpatialHash(cell_size)
+
     def perform_action(self, action_id):
         """Change speed to one of hero vectors"""
         assert 0 <= action_id < self.num_actions
@@ -109,13 +175,16 @@ class KarpathyGame(object):
     def spawn_object(self, obj_type):
         """Spawn object of a given type and add it to the objects array"""
         radius = self.settings["object_radius"] # default == 10
-        position = np.random.uniform([radius, radius], np.array(self.size) - radius) # randomly chooose X , Y position in the whole map
+        position = self.rng.uniform([radius, radius], np.array(self.size) - radius) # randomly chooose X , Y position in the whole map
         position = Point2(float(position[0]), float(position[1]))
         max_speed = np.array(self.settings["maximum_speed"]) # max speed is [50, 50]
-        speed    = np.random.uniform(-max_speed, max_speed).astype(float) # randomly chooose X speed, Y speed from [-50,50] boundary
+        speed    = self.rng.uniform(-max_speed, max_speed).astype(float) # randomly chooose X speed, Y speed from [-50,50] boundary
         speed = Vector2(float(speed[0]), float(speed[1]))
 
-        self.objects.append(GameObject(position, speed, obj_type, self.settings)) # make GameObject with above setting and append in list
+        obj = GameObject(position, speed, obj_type, self.settings)
+        self.objects.append(obj) # make GameObject with above setting and append in list
+        if self.spatial_index is not None:
+            self.spatial_index.insert(obj, obj.position)
 
     # step function is called every frame
     def step(self, dt): 
@@ -126,7 +195,11 @@ class KarpathyGame(object):
         # call step function of each object
         for obj in self.objects + [self.hero] :
             obj.step(dt)
-        
+
+        if self.spatial_index is not None:
+            for obj in self.objects:
+                self.spatial_index.update(obj, obj.position)
+
         # collision check process
         self.resolve_collisions()
 
@@ -136,14 +209,24 @@ class KarpathyGame(object):
         collision_distance2 = collision_distance ** 2
         to_remove = []
         
+        candidates = self.objects
+        if self.spatial_index is not None:
+            candidates = self.spatial_index.query(self.hero.position, collision_distance)
+
         # for all object, if here touch that object, append that in the remove list
-        for obj in self.objects:
+        for obj in candidates:
             if self.squared_distance(self.hero.position, obj.position) < collision_distance2:
                 to_remove.append(obj)
-                
+
+        if self.spatial_index is not None:
+            # eat in the same order as without the index
+            to_remove.sort(key=self.objects.index)
+
         # for all remove item
         for obj in to_remove:
             self.objects.remove(obj) # remove that item from the [self.objects] list
+            if self.spatial_index is not None:
+                self.spatial_index.remove(obj)
             self.objects_eaten[obj.obj_type] += 1 # and count the object_eaten number by obj_type
             self.object_reward += self.settings["object_reward"][obj.obj_type] # get a reward following the object_reward setting
             self.spawn_object(obj.obj_type) # and spawn that type object again ( randomly initialize)
@@ -151,6 +234,14 @@ class KarpathyGame(object):
     def squared_distance(self, p1, p2):
         return (p1[0] - p2[0]) ** 2 + (p1[1] - p2[1]) ** 2
 
+    def nearby_objects(self, position, radius):
+        """Return objects closer than radius to position, in the order of self.objects
+        unless spatial index is used."""
+        candidates = self.objects
+        if self.spatial_index is not None:
+            candidates = self.spatial_index.query(position, radius)
+        return [obj for obj in candidates if obj.position.distance(position) < radius]
+
     def inside_walls(self, point):
         """Check if the point is inside the walls"""
         EPS = 1e-4
@@ -161,28 +252,40 @@ class KarpathyGame(object):
         """Return observation vector. For all the observation directions it returns representation
         of the closest object to the hero - might be nothing, another object or a wall.
         Representation of observation for all the directions will be concatenated.
+
+        If settings["vectorized_observation"] is set, observe_vectorized is used instead.
+
+        Walls seen by the antennas are reused while the hero stays within
+        settings["observation_cache_tolerance"] (0 by default, so only if
+        the hero did not move at all) of the position where they were
+        computed - see wall_observation.
         """
+        if self.settings.get("vectorized_observation", False):
+            return self.observe_vectorized()
+
         num_obj_types = len(self.settings["objects"]) + 1 # 3 == (friend, enemy and wall)
         max_speed_x, max_speed_y = self.settings["maximum_speed"]
 
         observable_distance = self.settings["observation_line_length"] # length of antenna == 120
 
-        relevant_objects = [obj for obj in self.objects
-                            if obj.position.distance(self.hero.position) < observable_distance]
+        relevant_objects = self.nearby_objects(self.hero.position, observable_distance)
         # recall the objects near from hero with given that length
         
         # objects sorted from closest to furthest
         relevant_objects.sort(key=lambda x: x.position.distance(self.hero.position))
 
+        # which lines end outside of walls and how far they see the wall
+        outside, wall_proximity = self.wall_observation()
+
         observation        = np.zeros(self.observation_size) # 32*5 (objects * features) + 2 ( hero's speed)
         observation_offset = 0
-        for i, observation_line in enumerate(self.observation_lines): # for 32 lines
+        for i, (start_offset, end_offset) in enumerate(self.observation_offsets): # for 32 lines
             # shift the antenna's center to hero position
-            observation_line = LineSegment2(self.hero.position + Vector2(*observation_line.p1), self.hero.position + Vector2(*observation_line.p2))
+            observation_line = LineSegment2(self.hero.position + start_offset, self.hero.position + end_offset)
 
             observed_object = None
             # if end of observation line is outside of walls, we see the wall.
-            if not self.inside_walls(observation_line.p2): # p1 is start, p2 is end of the line
+            if outside[i]: # p1 is start, p2 is end of the line
                 observed_object = "**wall**"
                 # defaulyt see the wall,
                 
@@ -200,21 +303,9 @@ class KarpathyGame(object):
                 object_type_id = num_obj_types - 1 # object type id of all == 2
                 # a wall has fairly low speed...
                 speed_x, speed_y = 0, 0
-                # best candidate is intersection between observation_line and a wall, that's closest to the hero
-                best_candidate = None
-                
-                for wall in self.walls: # for all wall about each lines (32 * 4 times)
-                    candidate = observation_line.intersect(wall) # LineSegment2 has intersect function
-                    # so this calculate the intersected point with wall
-                    if candidate is not None:
-                        if (best_candidate is None or best_candidate.distance(self.hero.position) > candidate.distance(self.hero.position)):
-                            best_candidate = candidate # change the best candidate
-                            
-                if best_candidate is None:
-                    # assume it is due to rounding errors and wall is barely touching observation line
-                    proximity = observable_distance
-                else:
-                    proximity = best_candidate.distance(self.hero.position)
+                if np.isnan(wall_proximity[i]): # not cached yet
+                    wall_proximity[i] = self.wall_line_proximity(observation_line)
+                proximity = wall_proximity[i]
                     
             elif observed_object is not None: # agent seen
                 object_type_id = self.settings["objects"].index(observed_object.obj_type) # index of that obj_type, -> 0:friend, 1:enemy
@@ -250,6 +341,132 @@ class KarpathyGame(object):
 
         return observation
 
+    def wall_line_proximity(self, observation_line):
+        """Return distance from the hero to the closest wall crossed by observation_line"""
+        # best candidate is intersection between observation_line and a wall, that's closest to the hero
+        best_candidate = None
+
+        for wall in self.walls: # for all wall about each lines (32 * 4 times)
+            candidate = observation_line.intersect(wall) # LineSegment2 has intersect function
+            # so this calculate the intersected point with wall
+            if candidate is not None:
+                if (best_candidate is None or best_candidate.distance(self.hero.position) > candidate.distance(self.hero.position)):
+                    best_candidate = candidate # change the best candidate
+
+        if best_candidate is None:
+            # assume it is due to rounding errors and wall is barely touching observation line
+            return self.settings["observation_line_length"]
+        return best_candidate.distance(self.hero.position)
+
+    def wall_observation(self):
+        """Return (outside, proximity) arrays with an entry for every observation line -
+        whether the line ends outside of walls and its distance to the wall, NaN
+        until observe computes it (only lines that do not see an object need it).
+
+        Walls only depend on hero position, so the arrays are kept and returned
+        again while the hero is closer than settings["observation_cache_tolerance"]
+        to the position they were computed for. Observing every frame at high fps
+        the hero moves very little, and a tolerance of a fraction of a pixel
+        saves most of the intersections with walls."""
+        hero      = (self.hero.position.x, self.hero.position.y)
+        tolerance = self.settings.get("observation_cache_tolerance", 0.0)
+        if self.wall_cache is not None:
+            cached_hero, outside, proximity = self.wall_cache
+            if self.squared_distance(hero, cached_hero) <= tolerance ** 2:
+                return outside, proximity
+
+        # if end of observation line is outside of walls, we see the wall.
+        ends = np.array(hero) + self.observation_ends
+        EPS = 1e-4
+        outside = ~((EPS <= ends[:, 0]) & (ends[:, 0] < self.size[0] - EPS) &
+                    (EPS <= ends[:, 1]) & (ends[:, 1] < self.size[1] - EPS))
+        proximity = np.full(len(self.observation_lines), np.nan)
+        self.wall_cache = (hero, outside, proximity)
+        return outside, proximity
+
+    def object_arrays(self, objects=None):
+        """Return positions, speeds and type ids (index in settings["objects"])
+        of objects (all the objects by default) as numpy arrays"""
+        if objects is None:
+            objects = self.objects
+        positions = np.array([(obj.position.x, obj.position.y) for obj in objects], dtype=np.float64).reshape(-1, 2)
+        speeds    = np.array([(obj.speed.x, obj.speed.y)       for obj in objects], dtype=np.float64).reshape(-1, 2)
+        type_ids  = np.array([self.settings["objects"].index(obj.obj_type) for obj in objects], dtype=np.int32)
+        return positions, speeds, type_ids
+
+    def observe_vectorized(self):
+        """Return the same observation vector as observe, but intersect all
+        the observation lines with all the objects and walls at once
+        using numpy, instead of thousands of calls to euclid. Results
+        can differ from observe in the last bits, as euclid squares
+        numbers with libm pow rather than exact multiplication."""
+        num_obj_types = len(self.settings["objects"]) + 1
+        max_speed = np.array(self.settings["maximum_speed"], dtype=np.float64)
+        observable_distance = self.settings["observation_line_length"]
+        radius = self.settings["object_radius"]
+        hero = np.array([self.hero.position.x, self.hero.position.y])
+
+        # objects sorted from closest to furthest
+        if self.spatial_index is not None:
+            positions, speeds, type_ids = self.object_arrays(
+                    self.spatial_index.query(self.hero.position, observable_distance))
+        else:
+            positions, speeds, type_ids = self.object_arrays()
+        distances = np.sqrt(np.sum((positions - hero) ** 2, axis=1))
+        relevant = np.flatnonzero(distances < observable_distance)
+        relevant = relevant[np.argsort(distances[relevant], kind="stable")]
+        centers  = positions[relevant]
+
+        # observation lines shifted to hero position [lines, 2]
+        starts = hero + self.observation_starts
+        ends   = hero + self.observation_ends
+
+        # distance from every line to every relevant object [lines, objects]
+        hit = point_segment_distances(starts[:, np.newaxis, :], ends[:, np.newaxis, :],
+                                      centers[np.newaxis, :, :]) < radius
+
+        # every line sees the closest object it touches
+        object_lines = np.flatnonzero(np.any(hit, axis=1))
+        # argmax of [0, 0] array fails when there are no objects nearby
+        seen = relevant[np.argmax(hit[object_lines], axis=1)] if len(object_lines) > 0 else relevant[:0]
+
+        # proximity is distance to the closer end of the chord cut by the object
+        p, v = starts[object_lines], ends[object_lines] - starts[object_lines]
+        u1, u2, _ = segment_circle_intersections(starts[object_lines], ends[object_lines], positions[seen], radius)
+        d1 = np.sqrt(np.sum((p + u1[:, np.newaxis] * v - hero) ** 2, axis=1))
+        d2 = np.sqrt(np.sum((p + u2[:, np.newaxis] * v - hero) ** 2, axis=1))
+        # chord degenerated to a single point
+        object_proximity = np.where(u1 == u2, observable_distance, np.minimum(d1, d2))
+
+        # if end of observation line is outside of walls, and no object is seen, we see the wall.
+        outside, wall_proximity = self.wall_observation()
+        outside = outside.copy()
+        outside[object_lines] = False
+        wall_lines = np.flatnonzero(outside)
+
+        # intersection of every wall with every line that sees a wall and is not cached [lines, walls]
+        missing = wall_lines[np.isnan(wall_proximity[wall_lines])]
+        wp, wv = self.wall_starts[np.newaxis, :, :], (self.wall_ends - self.wall_starts)[np.newaxis, :, :]
+        _, ua, crossing = segment_intersections(starts[missing][:, np.newaxis, :], ends[missing][:, np.newaxis, :],
+                                                self.wall_starts[np.newaxis, :, :], self.wall_ends[np.newaxis, :, :])
+        intersections = wp + np.where(crossing, ua, 0.0)[..., np.newaxis] * wv
+        wall_distances = np.sqrt(np.sum((intersections - hero) ** 2, axis=2))
+        wall_distances = np.where(crossing, wall_distances, np.inf)
+        # no intersection is due to rounding errors and wall is barely touching observation line
+        missing_proximity = np.min(wall_distances, axis=1, initial=np.inf)
+        wall_proximity[missing] = np.where(np.isinf(missing_proximity), observable_distance, missing_proximity)
+
+        observation = np.zeros(self.observation_size)
+        eyes = observation[:-2].reshape(len(self.observation_lines), self.eye_observation_size)
+        eyes[:, :num_obj_types] = 1.0
+        eyes[object_lines, type_ids[seen]] = object_proximity / observable_distance
+        eyes[object_lines, num_obj_types:num_obj_types + 2] = speeds[seen] / max_speed
+        eyes[wall_lines, num_obj_types - 1] = wall_proximity[wall_lines] / observable_distance
+
+        # the last two observation is hero's own speed ratio
+        observation[-2] = self.hero.speed[0] / max_speed[0]
+        observation[-1] = self.hero.speed[1] / max_speed[1]
+        return observation
 
     def collect_reward(self): # collect reward for each steps
         """Return accumulated object eating score + current distance to walls score"""
@@ -318,15 +535,19 @@ class KarpathyGame(object):
         ])
 
         scene = svg.Scene((self.size[0] + 20, self.size[1] + 20 + 20 * len(stats)))
-        scene.add(svg.Rectangle((10, 10), self.size))
-
-
-        for line in self.observation_lines:
-            scene.add(svg.Line(line.p1 + self.hero.position + Point2(10,10),
-                               line.p2 + self.hero.position + Point2(10,10)))
-
-        for obj in self.objects + [self.hero] :
-            scene.add(obj.draw())
+        scene.add(self.svg_frame)
+
+        # lines and circles are rendered from arrays in one go
+        # (same output as Line for every observation line and draw for every object)
+        hero_position = np.array([self.hero.position.x, self.hero.position.y])
+        scene.add(svg.Lines(self.observation_starts + hero_position + 10,
+                            self.observation_ends   + hero_position + 10))
+
+        positions, _, type_ids = self.object_arrays()
+        colors = [self.settings["colors"][obj_type] for obj_type in self.settings["objects"]]
+        scene.add(svg.Circles(np.vstack([positions, hero_position]) + 10,
+                              self.hero.radius,
+                              [colors[type_id] for type_id in type_ids] + [self.settings["colors"]["hero"]]))
 
         offset = self.size[1] + 15
         for txt in stats:
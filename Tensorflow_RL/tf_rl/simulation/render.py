@@ -0,0 +1,118 @@
+"""
+Offline rendering of trajectories recorded with tf_rl.simulation.trajectory.
+
+    python -m tf_rl.simulation.render trajectory.bin --svg-dir frames/ --start 100 --stop 200
+    python -m tf_rl.simulation.render trajectory.bin --animation run.gif --fps 30
+"""
+import argparse
+import numpy as np
+
+from os import makedirs
+from os.path import exists, join
+
+import tf_rl.utils.svg as svg
+
+from .trajectory import TrajectoryReader
+
+def frame_to_svg(header, frame, stats=[]):
+    """Return svg.Scene of a frame, laid out the same way as KarpathyGame.to_html"""
+    size   = header["world_size"]
+    radius = header["object_radius"]
+    colors = header["colors"]
+    hero_x, hero_y = frame.hero_position
+
+    nearest_wall = min(hero_x, hero_y, size[0] - hero_x, size[1] - hero_y) - radius
+    objects_eaten_str = ', '.join(["%s: %s" % (o,c) for o,c in frame.objects_eaten.items()])
+    stats = stats[:]
+    stats.extend([
+        "nearest wall = %.1f" % (nearest_wall,),
+        "reward       = %.1f" % (frame.recent_reward,),
+        "objects eaten => %s" % (objects_eaten_str,),
+    ])
+
+    scene = svg.Scene((size[0] + 20, size[1] + 20 + 20 * len(stats)))
+    scene.add(svg.Rectangle((10, 10), size))
+
+    hero_position = np.array([hero_x, hero_y])
+    lines = np.array(header["observation_lines"], dtype=np.float64).reshape(-1, 2, 2)
+    scene.add(svg.Lines(lines[:, 0] + hero_position + 10, lines[:, 1] + hero_position + 10))
+
+    object_colors = [colors[obj_type] for obj_type in header["objects"]]
+    scene.add(svg.Circles(np.vstack([frame.positions, hero_position]) + 10, radius,
+                          [object_colors[type_id] for type_id in frame.types.tolist()] + [colors["hero"]]))
+
+    offset = size[1] + 15
+    for txt in stats:
+        scene.add(svg.Text((10, offset + 20), txt, 15))
+        offset += 20
+
+    return scene
+
+def render_svg(trajectory_path, directory, start=0, stop=None):
+    """Write frames from start to stop as directory/<frame_no>.svg"""
+    if not exists(directory):
+        makedirs(directory)
+    with TrajectoryReader(trajectory_path) as reader:
+        for frame in reader.frames(start, stop):
+            with open(join(directory, "%d.svg" % (frame.frame_no,)), "w") as f:
+                frame_to_svg(reader.header, frame).write_svg(f)
+
+def render_animation(trajectory_path, output_path, start=0, stop=None, fps=30, dpi=80):
+    """Render frames from start to stop as animation using matplotlib.
+
+    Format is chosen from extension of output_path - .gif is written
+    with Pillow, everything else (e.g. .mp4) with ffmpeg."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from matplotlib.animation import FuncAnimation
+
+    with TrajectoryReader(trajectory_path) as reader:
+        header = reader.header
+        frames = list(reader.frames(start, stop))
+        size   = header["world_size"]
+        object_colors = [header["colors"][obj_type] for obj_type in header["objects"]]
+        # scatter sizes are in points^2
+        marker_size = (2 * header["object_radius"] * 72.0 / dpi) ** 2
+
+        fig = plt.figure(figsize=(size[0] / float(dpi), size[1] / float(dpi)), dpi=dpi)
+        ax  = fig.add_axes([0, 0, 1, 1])
+        ax.set_xlim(0, size[0])
+        ax.set_ylim(size[1], 0)
+        ax.set_xticks([])
+        ax.set_yticks([])
+        objects = ax.scatter([], [], s=marker_size, edgecolors="black")
+        hero    = ax.scatter([], [], s=marker_size, c=header["colors"]["hero"], edgecolors="black")
+        text    = ax.text(5, 15, "", fontsize=10)
+
+        def update(frame):
+            objects.set_offsets(frame.positions if len(frame.positions) else np.zeros((0, 2)))
+            objects.set_facecolors([object_colors[type_id] for type_id in frame.types])
+            hero.set_offsets([frame.hero_position])
+            text.set_text("frame %d, reward %.1f" % (frame.frame_no, frame.recent_reward))
+            return objects, hero, text
+
+        animation = FuncAnimation(fig, update, frames=frames, blit=True)
+        writer = "pillow" if output_path.endswith(".gif") else "ffmpeg"
+        animation.save(output_path, writer=writer, fps=fps, dpi=dpi)
+        plt.close(fig)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render recorded trajectory.")
+    parser.add_argument("trajectory", help="file written by TrajectoryRecorder")
+    parser.add_argument("--start", type=int, default=0, help="index of the first rendered frame")
+    parser.add_argument("--stop", type=int, default=None, help="index after the last rendered frame")
+    parser.add_argument("--svg-dir", default=None, help="write every frame as svg to this directory")
+    parser.add_argument("--animation", default=None, help="write animation (.gif, .mp4) to this file")
+    parser.add_argument("--fps", type=int, default=30)
+    args = parser.parse_args(argv)
+
+    if args.svg_dir is None and args.animation is None:
+        parser.error("one of --svg-dir and --animation is required")
+    if args.svg_dir is not None:
+        render_svg(args.trajectory, args.svg_dir, args.start, args.stop)
+    if args.animation is not None:
+        render_animation(args.trajectory, args.animation, args.start, args.stop, args.fps)
+
+if __name__ == '__main__':
+    main()
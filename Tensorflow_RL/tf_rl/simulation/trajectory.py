@@ -0,0 +1,202 @@
+"""
+Compact binary recording of KarpathyGame trajectories.
+
+A trajectory file starts with a JSON header describing the game
+(world size, object types, colors, observation lines), followed by one
+binary record per recorded frame and, once the recorder is closed,
+an index of record offsets, so that any frame can be read without
+scanning the file. Record of a frame is
+
+    frame_no, number of objects n     int64, uint32
+    hero position and speed           4 x float32
+    recent reward                     float32
+    objects eaten of every type       uint32 x number of object types
+    object positions                  float32 x n x 2
+    object type ids                   uint8 x n
+
+all little endian. Records are accumulated in memory and written
+in chunks, so recording a frame costs a few array copies.
+
+Frames can be turned into SVG or animations with tf_rl.simulation.render.
+"""
+import json
+import numpy as np
+import struct
+
+from collections import namedtuple
+
+MAGIC       = b"TFRLTRJ1"
+FRAME       = struct.Struct("<qI5f")
+HEADER_SIZE = struct.Struct("<I")
+TRAILER     = struct.Struct("<QQ8s")
+
+Frame = namedtuple("Frame", ["frame_no", "hero_position", "hero_speed", "recent_reward",
+                             "objects_eaten", "positions", "types"])
+
+class TrajectoryRecorder(object):
+    def __init__(self, path, game, chunk_frames=256):
+        """Record frames of game to file at path.
+
+        Parameters
+        -------
+        path: str
+            file to write, overwritten if it exists
+        game: KarpathyGame or ArrayKarpathyGame
+            recorded game
+        chunk_frames: int
+            number of frames kept in memory before
+            they are written to the file
+        """
+        self.game         = game
+        self.chunk_frames = chunk_frames
+        self.object_types = list(game.settings["objects"])
+
+        header = {
+            "world_size":        list(game.size),
+            "objects":           self.object_types,
+            "colors":            game.settings["colors"],
+            "object_radius":     game.settings["object_radius"],
+            "observation_lines": [[list(start), list(end)] for start, end in
+                                  zip(game.observation_starts.tolist(), game.observation_ends.tolist())],
+        }
+        header = json.dumps(header).encode("utf-8")
+
+        self.f = open(path, "wb")
+        self.f.write(MAGIC + HEADER_SIZE.pack(len(header)) + header)
+        self.offset = self.f.tell()
+
+        self.chunk         = bytearray()
+        self.chunk_length  = 0
+        self.frame_offsets = []
+        self.frames_recorded = 0
+
+    def record(self, frame_no=None):
+        """Append current state of the game as a new frame.
+        Frames are numbered consecutively unless frame_no is given."""
+        if frame_no is None:
+            frame_no = self.frames_recorded
+        game = self.game
+        positions, _, type_ids = game.object_arrays()
+        recent_reward = game.collected_rewards[-100:] + [0]
+
+        self.frame_offsets.append(self.offset + len(self.chunk))
+        self.chunk += FRAME.pack(frame_no, len(type_ids),
+                                 game.hero.position[0], game.hero.position[1],
+                                 game.hero.speed[0],    game.hero.speed[1],
+                                 sum(recent_reward) / len(recent_reward))
+        self.chunk += np.array([game.objects_eaten[obj_type] for obj_type in self.object_types],
+                               dtype="<u4").tobytes()
+        self.chunk += np.asarray(positions, dtype="<f4").tobytes()
+        self.chunk += np.asarray(type_ids, dtype=np.uint8).tobytes()
+
+        self.frames_recorded += 1
+        self.chunk_length    += 1
+        if self.chunk_length >= self.chunk_frames:
+            self.flush()
+
+    def flush(self):
+        """Write frames kept in memory to the file"""
+        self.f.write(self.chunk)
+        self.f.flush()
+        self.offset += len(self.chunk)
+        self.chunk        = bytearray()
+        self.chunk_length = 0
+
+    def close(self):
+        """Write remaining frames and the index, and close the file"""
+        if self.f.closed:
+            return
+        self.flush()
+        self.f.write(np.array(self.frame_offsets, dtype="<u8").tobytes())
+        self.f.write(TRAILER.pack(self.offset, len(self.frame_offsets), MAGIC))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TrajectoryReader(object):
+    def __init__(self, path):
+        """Random access to frames of a file written by TrajectoryRecorder.
+
+        If the recorder was not closed (for example the process was
+        killed), there is no index and the file is scanned once
+        to find all complete frames."""
+        self.f = open(path, "rb")
+        if self.f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a trajectory file" % (path,))
+        header_size, = HEADER_SIZE.unpack(self.f.read(HEADER_SIZE.size))
+        self.header = json.loads(self.f.read(header_size).decode("utf-8"))
+        self.num_object_types = len(self.header["objects"])
+        self.frames_start = self.f.tell()
+
+        self.frame_offsets = self.read_index()
+        if self.frame_offsets is None:
+            self.frame_offsets = self.scan()
+
+    def read_index(self):
+        """Return frame offsets stored by TrajectoryRecorder.close or None"""
+        self.f.seek(0, 2)
+        file_size = self.f.tell()
+        if file_size - self.frames_start < TRAILER.size:
+            return None
+        self.f.seek(file_size - TRAILER.size)
+        index_offset, num_frames, magic = TRAILER.unpack(self.f.read(TRAILER.size))
+        if magic != MAGIC or index_offset + 8 * num_frames + TRAILER.size != file_size:
+            return None
+        self.f.seek(index_offset)
+        return np.frombuffer(self.f.read(8 * num_frames), dtype="<u8").astype(np.int64)
+
+    def record_size(self, num_objects):
+        return FRAME.size + 4 * self.num_object_types + 9 * num_objects
+
+    def scan(self):
+        """Find offsets of all the complete frames by reading them in order"""
+        self.f.seek(0, 2)
+        file_size = self.f.tell()
+        offsets, offset = [], self.frames_start
+        while offset + FRAME.size <= file_size:
+            self.f.seek(offset)
+            _, num_objects = FRAME.unpack(self.f.read(FRAME.size))[:2]
+            if offset + self.record_size(num_objects) > file_size:
+                break
+            offsets.append(offset)
+            offset += self.record_size(num_objects)
+        return np.array(offsets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.frame_offsets)
+
+    def __getitem__(self, idx):
+        """Return idx-th recorded frame as Frame"""
+        offset = int(self.frame_offsets[idx])
+        self.f.seek(offset)
+        frame_no, num_objects, hero_x, hero_y, hero_vx, hero_vy, recent_reward = \
+                FRAME.unpack(self.f.read(FRAME.size))
+        data = self.f.read(self.record_size(num_objects) - FRAME.size)
+
+        T, n = self.num_object_types, num_objects
+        objects_eaten = np.frombuffer(data, dtype="<u4", count=T)
+        positions     = np.frombuffer(data, dtype="<f4", count=2 * n, offset=4 * T).reshape(n, 2)
+        types         = np.frombuffer(data, dtype=np.uint8, count=n, offset=4 * T + 8 * n)
+        return Frame(frame_no, (hero_x, hero_y), (hero_vx, hero_vy), recent_reward,
+                     dict(zip(self.header["objects"], objects_eaten.tolist())),
+                     positions.astype(np.float64), types)
+
+    def frames(self, start=0, stop=None):
+        """Iterate over frames with indices from start to stop"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        for idx in range(start, stop):
+            yield self[idx]
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
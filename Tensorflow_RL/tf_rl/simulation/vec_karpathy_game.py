@@ -0,0 +1,60 @@
+import numpy as np
+
+from .karpathy_game import KarpathyGame
+from tf_rl.utils.seeding import spawn_rngs
+
+class VecKarpathyGame(object):
+    def __init__(self, settings, num_envs, game_class=KarpathyGame, seed=None):
+        """Steps num_envs independent games in lockstep.
+
+        Observations of all the games are stacked into a single
+        [num_envs, observation_size] array and actions are
+        given as a batch, so that a single forward pass of the
+        controller can score all the games at once.
+
+        Parameters
+        -------
+        settings: dict
+            settings passed to every game
+        num_envs: int
+            number of independent games
+        game_class: class
+            KarpathyGame or ArrayKarpathyGame
+        seed: int
+            every game gets its own generator derived from seed
+        """
+        self.settings = settings
+        self.num_envs = num_envs
+        self.games    = [game_class(settings, seed=rng) for rng in spawn_rngs(seed, num_envs)]
+
+        self.observation_size = self.games[0].observation_size
+        self.num_actions      = self.games[0].num_actions
+
+    def step(self, dt):
+        """Simulate all the games for a given ammount of time"""
+        for game in self.games:
+            game.step(dt)
+
+    def observe(self):
+        """Return [num_envs, observation_size] array of observations"""
+        observations = np.empty((self.num_envs, self.observation_size))
+        for i, game in enumerate(self.games):
+            observations[i] = game.observe()
+        return observations
+
+    def collect_reward(self):
+        """Return [num_envs] array of rewards collected since last call"""
+        return np.array([game.collect_reward() for game in self.games])
+
+    def perform_action(self, action_ids):
+        """Perform action_ids[i] in i-th game"""
+        assert len(action_ids) == self.num_envs
+        for game, action_id in zip(self.games, action_ids):
+            game.perform_action(action_id)
+
+    def _repr_html_(self):
+        return self.to_html()
+
+    def to_html(self, stats=[]):
+        """Return svg representation of the first game"""
+        return self.games[0].to_html(stats)
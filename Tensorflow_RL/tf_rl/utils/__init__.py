@@ -1,10 +1,9 @@
-import tensorflow as tf
-
 def base_name(var):
     """Extracts value passed to name= when creating a variable"""
     return var.name.split('/')[-1].split(':')[0]
 
 def copy_variables(variables):
+    import tensorflow as tf
     res = {}
     for v in variables:
         name = base_name(v)
@@ -32,10 +32,61 @@ def point_projected_on_line(line_s, line_e, point):
 def point_segment_distance(segment_s, segment_e, point):
     """Returns distance from point to the closest point on segment
     connecting points segment_s and segment_e"""
-    projected = point_projected_on_line(segment_s, segment_e, point)
-    if np.isclose(point_distance(segment_s, projected) + point_distance(projected, segment_e),
-        point_distance(segment_s, segment_e)):
-        # projected on segment
-        return point_distance(point, projected)
-    else:
-        return min(point_distance(point, segment_s), point_distance(point, segment_e))
+    segment_along = segment_e - segment_s
+    u = segment_projection(segment_s, segment_e, point)
+    return point_distance(point, segment_s + u * segment_along)
+
+# Batched versions of the above. Every argument is an array of points
+# of shape [..., 2] and the leading dimensions are broadcasted, so for
+# example M points against K segments are computed at once with
+#
+#   point_segment_distances(segment_s[np.newaxis, :, :], segment_e[np.newaxis, :, :],
+#                           points[:, np.newaxis, :])          # -> [M, K]
+
+def segment_projection(segment_s, segment_e, points):
+    """Returns parameter u in [0, 1] of the point segment_s + u * (segment_e - segment_s)
+    closest to every point. Zero length segments project everything on segment_s."""
+    segment_along = segment_e - segment_s
+    along_norm2   = np.sum(segment_along ** 2, axis=-1)
+    nondegenerate = along_norm2 > 0
+    u = np.sum((points - segment_s) * segment_along, axis=-1) / np.where(nondegenerate, along_norm2, 1.0)
+    return np.clip(np.where(nondegenerate, u, 0.0), 0.0, 1.0)
+
+def point_segment_distances(segment_s, segment_e, points):
+    """Returns distances from points to the closest points on segments"""
+    segment_along = segment_e - segment_s
+    u = segment_projection(segment_s, segment_e, points)
+    closest = segment_s + u[..., np.newaxis] * segment_along
+    return np.sqrt(np.sum((points - closest) ** 2, axis=-1))
+
+def segment_circle_intersections(segment_s, segment_e, centers, radius):
+    """Intersect segments (rays of finite length) with circles.
+
+    Returns (u1, u2, hit) - parameters along the segments of both ends
+    of the chord cut by the circle, clamped to [0, 1], and whether
+    the line through the segment touches the circle at all."""
+    p, v, c = segment_s, segment_e - segment_s, centers
+    a  = np.sum(v ** 2, axis=-1)
+    b  = 2 * np.sum(v * (p - c), axis=-1)
+    cc = np.sum(c ** 2, axis=-1) + np.sum(p ** 2, axis=-1) - 2 * np.sum(c * p, axis=-1) - radius ** 2
+    discriminant = b ** 2 - 4 * a * cc
+    sq = np.sqrt(np.maximum(discriminant, 0.0))
+    u1 = np.clip((-b + sq) / (2 * a), 0.0, 1.0)
+    u2 = np.clip((-b - sq) / (2 * a), 0.0, 1.0)
+    return u1, u2, discriminant >= 0
+
+def segment_intersections(a_s, a_e, b_s, b_e):
+    """Intersect segments a with segments b.
+
+    Returns (t_a, t_b, crossing), where the intersection is
+    a_s + t_a * (a_e - a_s) == b_s + t_b * (b_e - b_s) and crossing
+    tells if it lies on both segments. Parallel segments never cross."""
+    a_along, b_along = a_e - a_s, b_e - b_s
+    d  = a_along[..., 1] * b_along[..., 0] - a_along[..., 0] * b_along[..., 1]
+    dy = b_s[..., 1] - a_s[..., 1]
+    dx = b_s[..., 0] - a_s[..., 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t_b = (a_along[..., 0] * dy - a_along[..., 1] * dx) / d
+        t_a = (b_along[..., 0] * dy - b_along[..., 1] * dx) / d
+    crossing = (d != 0) & (0.0 <= t_a) & (t_a <= 1.0) & (0.0 <= t_b) & (t_b <= 1.0)
+    return t_a, t_b, crossing
@@ -0,0 +1,72 @@
+from collections import deque
+
+
+class NStepAccumulator(object):
+    def __init__(self, n, discount_rate):
+        """Rolling window turning a stream of one step transitions
+        into n-step transitions
+
+            (s_t, a_t, r_t + d*r_{t+1} + ... + d^(n-1)*r_{t+n-1}, s_{t+n})
+
+        Discounted return of the oldest transition in the window is
+        maintained incrementally, so append costs O(1) amortized - the
+        return is recomputed from scratch once every n transitions,
+        so that rounding errors of the incremental update do not
+        accumulate.
+
+        Parameters
+        -------
+        n: int
+            number of rewards summed in a return
+        discount_rate: float (0 to 1)
+            discount d applied to later rewards
+        """
+        assert n >= 1, "n must be at least 1"
+        self.n             = n
+        self.discount_rate = discount_rate
+
+        # (observation, action, reward) of transitions still waiting for rewards
+        self.window               = deque()
+        self.discounted_return    = 0.0
+        self.pops_since_recompute = 0
+
+    def __len__(self):
+        return len(self.window)
+
+    def append(self, observation, action, reward, newobservation):
+        """Add one step transition and return list of n-step transitions
+        completed by it (at most one, unless newobservation is None).
+
+        If newobservation is None, the transition is assumed to be terminal
+        and all the transitions in the window are returned with truncated
+        returns and None as the new observation."""
+        self.discounted_return += self.discount_rate ** len(self.window) * reward
+        self.window.append((observation, action, reward))
+        if newobservation is None:
+            return self.flush()
+        if len(self.window) < self.n:
+            return []
+        first_observation, first_action, _ = self.window[0]
+        transition = (first_observation, first_action, self.discounted_return, newobservation)
+        self.pop()
+        return [transition]
+
+    def flush(self):
+        """Return all the transitions in the window as terminal
+        transitions and empty the window"""
+        transitions = []
+        while self.window:
+            first_observation, first_action, _ = self.window[0]
+            transitions.append((first_observation, first_action, self.discounted_return, None))
+            self.pop()
+        return transitions
+
+    def pop(self):
+        """Remove the oldest transition from the window"""
+        _, _, reward = self.window.popleft()
+        self.pops_since_recompute += 1
+        if self.pops_since_recompute >= self.n or self.discount_rate == 0:
+            self.discounted_return = sum(self.discount_rate ** i * r for i, (_, _, r) in enumerate(self.window))
+            self.pops_since_recompute = 0
+        else:
+            self.discounted_return = (self.discounted_return - reward) / self.discount_rate
@@ -0,0 +1,27 @@
+import numpy as np
+
+
+def make_rng(seed=None):
+    """Return np.random.Generator for seed.
+
+    seed can be None (fresh entropy from the OS), an int,
+    a np.random.SeedSequence or a np.random.Generator,
+    which is returned as is, so that components can share it."""
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(seed)
+
+def spawn_rngs(seed, n):
+    """Return n independent generators derived from seed.
+
+    Every component of a run (game, controller, replay buffer,
+    model) should get its own generator, so that the random numbers
+    drawn by one of them do not depend on how many numbers
+    were drawn by the others."""
+    if isinstance(seed, np.random.Generator):
+        seed = int(seed.integers(2 ** 63))
+    return [np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(n)]
+
+def tf_seed(rng):
+    """Draw operation level seed for TensorFlow random ops"""
+    return int(rng.integers(2 ** 31 - 1))
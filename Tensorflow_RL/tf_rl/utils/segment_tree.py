@@ -0,0 +1,68 @@
+import numpy as np
+
+
+class SegmentTree(object):
+    def __init__(self, capacity, operation, neutral_element):
+        """Binary tree over an array, that keeps operation applied
+        to every subtree in its root.
+
+        Updates and queries touch O(log n) nodes and are vectorized
+        over batches of indices - tree is traversed one level at a time
+        for all the indices at once.
+
+        Parameters
+        -------
+        capacity: int
+            number of elements in the array. It is internally
+            rounded up to the nearest power of two.
+        operation: numpy ufunc
+            associative binary operation, for example np.add
+            or np.minimum
+        neutral_element: float
+            value of empty elements, for example 0 for np.add
+        """
+        self.capacity = 1
+        while self.capacity < capacity:
+            self.capacity *= 2
+        self.operation = operation
+        self.tree = np.full(2 * self.capacity, neutral_element, dtype=np.float64)
+
+    def update(self, indices, values):
+        """Set array[indices] = values and refresh their ancestors"""
+        nodes = np.asarray(indices, dtype=np.int64) + self.capacity
+        if len(nodes) == 0:
+            return
+        self.tree[nodes] = values
+        while True:
+            nodes = np.unique(nodes // 2)
+            if nodes[0] < 1:
+                break
+            self.tree[nodes] = self.operation(self.tree[2 * nodes], self.tree[2 * nodes + 1])
+            if nodes[0] == 1:
+                break
+
+    def reduce(self):
+        """Result of operation over the whole array"""
+        return self.tree[1]
+
+    def __getitem__(self, indices):
+        return self.tree[self.capacity + np.asarray(indices, dtype=np.int64)]
+
+
+class SumTree(SegmentTree):
+    def __init__(self, capacity):
+        """Segment tree that keeps sums, used for proportional sampling"""
+        super(SumTree, self).__init__(capacity, np.add, 0.0)
+
+    def find_prefix_sum(self, prefix_sums):
+        """For every value v in prefix_sums find the index i,
+        such that sum(array[:i]) <= v < sum(array[:i+1])"""
+        prefix = np.array(prefix_sums, dtype=np.float64)
+        nodes  = np.ones(prefix.shape, dtype=np.int64)
+        while nodes[0] < self.capacity:
+            left     = 2 * nodes
+            left_sum = self.tree[left]
+            go_right = prefix >= left_sum
+            prefix   = np.where(go_right, prefix - left_sum, prefix)
+            nodes    = np.where(go_right, left + 1, left)
+        return nodes - self.capacity
@@ -0,0 +1,65 @@
+import math
+
+from collections import defaultdict
+
+class SpatialHash(object):
+    def __init__(self, cell_size):
+        """Uniform grid over the plane, that maps cells to items inside them.
+
+        Items are moved between cells incrementally as their positions
+        change and radius queries only look at cells overlapping
+        the query circle, so their cost depends on local density
+        rather than the total number of items.
+
+        Parameters
+        -------
+        cell_size: float
+            side of a grid cell. Queries are cheapest when it is
+            close to the typical query radius.
+        """
+        self.cell_size  = float(cell_size)
+        self.cells      = defaultdict(set)
+        self.item_cells = {}
+
+    def cell(self, position):
+        return (int(math.floor(position[0] / self.cell_size)),
+                int(math.floor(position[1] / self.cell_size)))
+
+    def __len__(self):
+        return len(self.item_cells)
+
+    def insert(self, item, position):
+        cell = self.cell(position)
+        self.cells[cell].add(item)
+        self.item_cells[item] = cell
+
+    def remove(self, item):
+        cell = self.item_cells.pop(item)
+        self.cells[cell].discard(item)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def update(self, item, position):
+        """Move item to position. O(1), and free if the cell did not change"""
+        cell = self.cell(position)
+        old_cell = self.item_cells[item]
+        if cell != old_cell:
+            self.cells[old_cell].discard(item)
+            if not self.cells[old_cell]:
+                del self.cells[old_cell]
+            self.cells[cell].add(item)
+            self.item_cells[item] = cell
+
+    def query(self, center, radius):
+        """Return items in cells overlapping the square of side 2*radius
+        around center. It is a superset of items within radius - callers
+        are expected to check exact distance."""
+        min_x, min_y = self.cell((center[0] - radius, center[1] - radius))
+        max_x, max_y = self.cell((center[0] + radius, center[1] + radius))
+        result = []
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                items = self.cells.get((x, y))
+                if items:
+                    result.extend(items)
+        return result
@@ -12,20 +12,29 @@ does a remarkable job of converting SVG files into other formats.
 
 import os
 
+from itertools import chain
+
 def colorstr(rgb):
     if type(rgb) == tuple:
         return "#%02x%02x%02x" % rgb
     else:
         return rgb
 
+# style strings depend only on color, so they are computed once per color.
+STYLE_CACHE = {}
+
 def compute_style(style):
     color = style.get("color")
+    if color in STYLE_CACHE:
+        return STYLE_CACHE[color]
     style_str = []
     if color is None:
-        color="none"
-    style_str.append('fill:%s;' % (colorstr(color),))
+        style_str.append('fill:none;')
+    else:
+        style_str.append('fill:%s;' % (colorstr(color),))
 
     style_str = 'style="%s"' % (';'.join(style_str),)
+    STYLE_CACHE[color] = style_str
     return style_str
 
 class Scene:
@@ -77,6 +86,45 @@ class Circle:
             "          %s />\n" % (style_str,)
         ]
 
+class Lines:
+    def __init__(self, starts, ends):
+        """Many lines at once - starts and ends are [n, 2] arrays.
+        Renders the same as a Line for every row."""
+        self.starts = starts
+        self.ends   = ends
+
+    def strarray(self):
+        coordinates = [c for start, end in zip(self.starts.tolist(), self.ends.tolist()) for c in start + end]
+        template = "  <line x1=\"%d\" y1=\"%d\" x2=\"%d\" y2=\"%d\" />\n"
+        return [(template * len(self.starts)) % tuple(coordinates)]
+
+
+class Circles:
+    def __init__(self, centers, radius, colors):
+        """Many circles at once - centers is [n, 2] array, colors
+        has a color for every circle and radius is shared by all.
+        Renders the same as a Circle for every row."""
+        self.centers = centers
+        self.radius  = radius
+        self.colors  = colors
+
+    def strarray(self):
+        styles = [compute_style({"color": color}) for color in self.colors]
+        values = chain.from_iterable((x, y, self.radius, style)
+                                     for (x, y), style in zip(self.centers.tolist(), styles))
+        template = "  <circle cx=\"%d\" cy=\"%d\" r=\"%d\"\n          %s />\n"
+        return [(template * len(styles)) % tuple(values)]
+
+
+class Static:
+    def __init__(self, items):
+        """Items rendered once, for parts of a scene that never change"""
+        self.rendered = ''.join(chain.from_iterable(item.strarray() for item in items))
+
+    def strarray(self):
+        return [self.rendered]
+
+
 class Rectangle:
     def __init__(self, origin, size, **style_kwargs):
         self.origin = origin